@@ -0,0 +1,113 @@
+"""Add submenus and dishes counts
+
+Revision ID: 3a7d2c9e41b8
+Revises: 285e51f4a140
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '3a7d2c9e41b8'
+down_revision = '285e51f4a140'
+branch_labels = None
+depends_on = None
+
+# written out, later changes of the models must not change what the revision does
+UPDATE_SUBMENUS_COUNT = '''
+CREATE OR REPLACE FUNCTION update_submenus_count() RETURNS trigger AS $$
+DECLARE
+    sign integer := CASE TG_OP WHEN 'INSERT' THEN 1 ELSE -1 END;
+BEGIN
+    UPDATE menus
+    SET submenus_count = menus.submenus_count + sign * changed.submenus_count,
+        dishes_count = menus.dishes_count + sign * changed.dishes_count
+    FROM (
+        SELECT menu_id, count(*) AS submenus_count, sum(dishes_count) AS dishes_count
+        FROM changed_rows
+        GROUP BY menu_id
+    ) AS changed
+    WHERE menus.id = changed.menu_id;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql
+'''
+UPDATE_DISHES_COUNT = '''
+CREATE OR REPLACE FUNCTION update_dishes_count() RETURNS trigger AS $$
+DECLARE
+    sign integer := CASE TG_OP WHEN 'INSERT' THEN 1 ELSE -1 END;
+BEGIN
+    UPDATE submenus
+    SET dishes_count = submenus.dishes_count + sign * changed.dishes_count
+    FROM (
+        SELECT submenu_id, count(*) AS dishes_count
+        FROM changed_rows
+        GROUP BY submenu_id
+    ) AS changed
+    WHERE submenus.id = changed.submenu_id;
+
+    UPDATE menus
+    SET dishes_count = menus.dishes_count + sign * changed.dishes_count
+    FROM (
+        SELECT submenus.menu_id, count(*) AS dishes_count
+        FROM changed_rows
+        JOIN submenus ON submenus.id = changed_rows.submenu_id
+        GROUP BY submenus.menu_id
+    ) AS changed
+    WHERE menus.id = changed.menu_id;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql
+'''
+COUNT_TRIGGER = '''
+CREATE TRIGGER {table}_count_{event}
+AFTER {event} ON {table}
+REFERENCING {transition} TABLE AS changed_rows
+FOR EACH STATEMENT EXECUTE FUNCTION update_{table}_count()
+'''
+TRIGGERS = (('submenus', UPDATE_SUBMENUS_COUNT), ('dishes', UPDATE_DISHES_COUNT))
+
+
+def upgrade() -> None:
+    op.add_column('menus', sa.Column('submenus_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('menus', sa.Column('dishes_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('submenus', sa.Column('dishes_count', sa.Integer(), server_default='0', nullable=False))
+
+    # tables are locked until the triggers are created, so no write is missed by the backfill
+    op.execute('LOCK TABLE menus, submenus, dishes IN SHARE ROW EXCLUSIVE MODE')
+    op.execute(
+        '''
+        UPDATE submenus
+        SET dishes_count = counts.dishes_count
+        FROM (SELECT submenu_id, count(*) AS dishes_count FROM dishes GROUP BY submenu_id) AS counts
+        WHERE submenus.id = counts.submenu_id
+        '''
+    )
+    op.execute(
+        '''
+        UPDATE menus
+        SET submenus_count = counts.submenus_count, dishes_count = counts.dishes_count
+        FROM (
+            SELECT menu_id, count(*) AS submenus_count, sum(dishes_count) AS dishes_count
+            FROM submenus
+            GROUP BY menu_id
+        ) AS counts
+        WHERE menus.id = counts.menu_id
+        '''
+    )
+    for table, function in TRIGGERS:
+        op.execute(function)
+        for event, transition in (('INSERT', 'NEW'), ('DELETE', 'OLD')):
+            op.execute(COUNT_TRIGGER.format(table=table, event=event, transition=transition))
+
+
+def downgrade() -> None:
+    for table, _ in TRIGGERS:
+        for event in ('INSERT', 'DELETE'):
+            op.execute(f'DROP TRIGGER {table}_count_{event} ON {table}')
+        op.execute(f'DROP FUNCTION update_{table}_count()')
+    op.drop_column('submenus', 'dishes_count')
+    op.drop_column('menus', 'dishes_count')
+    op.drop_column('menus', 'submenus_count')
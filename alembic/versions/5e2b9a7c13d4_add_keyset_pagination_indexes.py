@@ -0,0 +1,53 @@
+"""Add keyset pagination indexes
+
+Revision ID: 5e2b9a7c13d4
+Revises: 8c41f0d2b6e5
+Create Date: 2026-10-18 15:00:00.000000
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '5e2b9a7c13d4'
+down_revision = '8c41f0d2b6e5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # the foreign key indexes are extended with the id the pages are ordered by
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_submenus_menu_id_id',
+            'submenus',
+            ['menu_id', 'id'],
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            'ix_dishes_submenu_id_id',
+            'dishes',
+            ['submenu_id', 'id'],
+            postgresql_include=['title', 'description', 'price'],
+            postgresql_concurrently=True,
+        )
+        op.drop_index('ix_dishes_submenu_id', 'dishes', postgresql_concurrently=True)
+        op.drop_index('ix_submenus_menu_id', 'submenus', postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_submenus_menu_id',
+            'submenus',
+            ['menu_id'],
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            'ix_dishes_submenu_id',
+            'dishes',
+            ['submenu_id'],
+            postgresql_include=['id', 'title', 'description', 'price'],
+            postgresql_concurrently=True,
+        )
+        op.drop_index('ix_dishes_submenu_id_id', 'dishes', postgresql_concurrently=True)
+        op.drop_index('ix_submenus_menu_id_id', 'submenus', postgresql_concurrently=True)
@@ -0,0 +1,38 @@
+"""Add foreign key indexes
+
+Revision ID: 8c41f0d2b6e5
+Revises: 3a7d2c9e41b8
+Create Date: 2026-10-18 13:00:00.000000
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '8c41f0d2b6e5'
+down_revision = '3a7d2c9e41b8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # CONCURRENTLY doesn't lock writes of a live database, but can't run inside a transaction
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_submenus_menu_id',
+            'submenus',
+            ['menu_id'],
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            'ix_dishes_submenu_id',
+            'dishes',
+            ['submenu_id'],
+            postgresql_include=['id', 'title', 'description', 'price'],
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_dishes_submenu_id', 'dishes', postgresql_concurrently=True)
+        op.drop_index('ix_submenus_menu_id', 'submenus', postgresql_concurrently=True)
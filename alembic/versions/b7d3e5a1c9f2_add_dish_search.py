@@ -0,0 +1,45 @@
+"""Add dish search
+
+Revision ID: b7d3e5a1c9f2
+Revises: 5e2b9a7c13d4
+Create Date: 2026-10-18 16:00:00.000000
+
+"""
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'b7d3e5a1c9f2'
+down_revision = '5e2b9a7c13d4'
+branch_labels = None
+depends_on = None
+
+# written out, later changes of the models must not change what the revision does
+DISH_SEARCH_VECTOR = (
+    "setweight(to_tsvector('russian', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('russian', coalesce(description, '')), 'B')"
+)
+
+
+def upgrade() -> None:
+    # a stored generated column rewrites the table once
+    op.add_column(
+        'dishes',
+        sa.Column('search_vector', postgresql.TSVECTOR(), sa.Computed(DISH_SEARCH_VECTOR, persisted=True)),
+    )
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_dishes_search_vector',
+            'dishes',
+            ['search_vector'],
+            postgresql_using='gin',
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_dishes_search_vector', 'dishes', postgresql_concurrently=True)
+    op.drop_column('dishes', 'search_vector')
@@ -1,3 +1,7 @@
+import asyncio
+import hashlib
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 
 from fastapi import Depends, HTTPException
@@ -11,14 +15,30 @@ from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 from starlette import status
 
+from core.cache.local import LocalCache
 from core.database import Session, get_session
-from core.settings import JWT_ALGORITHM, JWT_EXPIRATION, JWT_SECRET
+from core.settings import (
+    JWT_ALGORITHM,
+    JWT_EXPIRATION,
+    JWT_SECRET,
+    PASSWORD_HASH_CONCURRENCY,
+    PASSWORD_HASH_ROUNDS,
+    TOKEN_CACHE_MAX_BYTES,
+    TOKEN_CACHE_MAX_ENTRIES,
+)
 
 from .models import User
 from .schemas import TokenSchema, UserAuthSchema, UserCreateSchema, UserSchema
 
 # oauth2_scheme = OAuth2PasswordBearer(tokenUrl='api/v1/auth/sing_in')
 
+# bcrypt releases the GIL: hashing in threads doesn't block the event loop,
+# the pool bounds the CPU time a burst of sign ins takes from the other requests
+password_hasher = bcrypt.using(rounds=PASSWORD_HASH_ROUNDS)
+password_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_CONCURRENCY, thread_name_prefix='password')
+# users of verified tokens by token digest, kept until the tokens expire
+token_cache = LocalCache(max_entries=TOKEN_CACHE_MAX_ENTRIES, max_bytes=TOKEN_CACHE_MAX_BYTES, ex=JWT_EXPIRATION)
+
 
 # def get_current_user(token: str = Depends(oauth2_scheme)) -> UserSchema:
 #     return UserCRUD.validate_token(token)
@@ -68,14 +88,23 @@ class UserCRUD:
 
     @staticmethod
     async def _verify_password(plain_password: str, hashed_password: str) -> bool:
-        return bcrypt.verify(plain_password, hashed_password)
+        # the cost is read from the hash, hashes made with other rounds are still verified
+        return await asyncio.get_running_loop().run_in_executor(
+            password_executor, password_hasher.verify, plain_password, hashed_password)
 
     @staticmethod
     async def _hash_password(password: str) -> str:
-        return bcrypt.hash(password)
+        return await asyncio.get_running_loop().run_in_executor(password_executor, password_hasher.hash, password)
 
     @staticmethod
     async def _validate_token(token: str) -> UserSchema:
+        # a hit skips the signature check and the parsing of the user.
+        # Every request gets its own copy, the cached user is shared by the requests with the token
+        key = hashlib.sha256(token.encode()).hexdigest()
+        user = token_cache.get(key)
+        if user is not None:
+            return user.copy()
+
         exception = HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail='Could not validate credentials',
@@ -90,6 +119,9 @@ class UserCRUD:
         except ValidationError:
             raise exception
 
+        expires_in = int(payload.get('exp', 0) - time.time())
+        if expires_in > 0:
+            token_cache.set(key, user.copy(), len(token), ex=expires_in)
         return user
 
     @staticmethod
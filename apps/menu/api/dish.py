@@ -1,14 +1,41 @@
 import uuid
+from decimal import Decimal
+from typing import Optional
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Query
 from starlette.status import HTTP_200_OK, HTTP_201_CREATED
 
-from apps.menu.schemas import DishBaseSchema, DishSchema
+from apps.menu.schemas import (
+    DishBaseSchema,
+    DishBatchResultSchema,
+    DishBatchSchema,
+    DishSchema,
+    DishSearchSchema,
+)
 from apps.menu.services import DishService
 from core.openapi.responses import RESPONSE_303, RESPONSE_404
+from core.pagination import Page
 
 router = APIRouter(
     prefix='/menus/{menu_id}/submenus/{submenu_id}/dishes', tags=['dish'])
+search_router = APIRouter(prefix='/dishes', tags=['dish'])
+
+
+@search_router.get(
+    '/search',
+    response_model=list[DishSearchSchema],
+    status_code=HTTP_200_OK,
+    summary='Поиск блюд',
+)
+async def search_dishes(
+    q: str = Query(..., min_length=1, max_length=200, description='Слова или начала слов названия и описания'),
+    page: Page = Depends(),
+    dish: DishService = Depends(),
+):
+    """Ищет блюда всех меню по названию и описанию, сначала наиболее подходящие.
+    Без `limit` возвращает первые PAGE_SIZE блюд.
+    Следующая страница запрашивается с `after`, равным id последнего блюда страницы"""
+    return await dish.search(q, page)
 
 
 @router.get(
@@ -17,9 +44,19 @@ router = APIRouter(
     status_code=HTTP_200_OK,
     summary='Список блюд подменю',
 )
-async def get_dishes(submenu_id: uuid.UUID, dish: DishService = Depends()):
-    """Возвращает список блюд указанного подменю"""
-    return await dish.get_all(submenu_id)
+async def get_dishes(
+    menu_id: uuid.UUID,
+    submenu_id: uuid.UUID,
+    page: Page = Depends(),
+    title: Optional[str] = Query(None, description='Часть названия блюда'),
+    min_price: Optional[Decimal] = Query(None, ge=0, description='Минимальная цена'),
+    max_price: Optional[Decimal] = Query(None, ge=0, description='Максимальная цена'),
+    dish: DishService = Depends(),
+):
+    """Возвращает страницу списка блюд указанного подменю.
+    Без `limit` возвращает весь список.
+    Следующая страница запрашивается с `after`, равным id последнего блюда страницы"""
+    return await dish.get_all(submenu_id, menu_id, page, title, min_price, max_price)
 
 
 @router.get(
@@ -29,9 +66,9 @@ async def get_dishes(submenu_id: uuid.UUID, dish: DishService = Depends()):
     summary='Получить блюдо',
     responses=RESPONSE_404,
 )
-async def get_dish(submenu_id: uuid.UUID, dish_id: uuid.UUID, dish: DishService = Depends()):
+async def get_dish(menu_id: uuid.UUID, submenu_id: uuid.UUID, dish_id: uuid.UUID, dish: DishService = Depends()):
     """Возвращает указанное блюдо"""
-    return await dish.get_by_id(dish_id, submenu_id)
+    return await dish.get_by_id(dish_id, submenu_id, menu_id)
 
 
 @router.post(
@@ -72,3 +109,21 @@ async def update_dish(
 ):
     """Обновляет указанное блюдо"""
     return await dish.update(dish_id, dish_data, submenu_id, menu_id)
+
+
+@router.post(
+    '/batch',
+    response_model=DishBatchResultSchema,
+    status_code=HTTP_200_OK,
+    summary='Пакетное изменение блюд',
+    responses=RESPONSE_404,
+)
+async def batch_dishes(
+    menu_id: uuid.UUID,
+    submenu_id: uuid.UUID,
+    batch: DishBatchSchema,
+    dish: DishService = Depends(),
+):
+    """Создает, обновляет и удаляет блюда указанного подменю одной транзакцией, например при синхронизации цен.
+    Если какое-либо из обновляемых или удаляемых блюд не найдено, ничего не изменяется"""
+    return await dish.batch(batch, submenu_id, menu_id)
@@ -1,20 +1,59 @@
 import uuid
+from typing import Optional
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Query
 from starlette.responses import FileResponse
 from starlette.status import HTTP_200_OK, HTTP_201_CREATED, HTTP_202_ACCEPTED
 
-from apps.menu.schemas import BaseSchema, MenuSchema
+from apps.menu.schemas import (
+    BaseSchema,
+    BatchSchema,
+    ExportFormat,
+    ExportStatusSchema,
+    MenuBatchResultSchema,
+    MenuSchema,
+    MenuTreeSchema,
+)
 from apps.menu.services import MenuService
 from core.openapi.responses import RESPONSE_303, RESPONSE_404
+from core.pagination import Page
 
 router = APIRouter(prefix='/menus', tags=['menu'])
 
 
 @router.get('/', response_model=list[MenuSchema], status_code=HTTP_200_OK, summary='Список меню')
-async def get_menus(menu: MenuService = Depends()):
-    """Возвращает список всех меню с количеством всех подменю и блюд"""
-    return await menu.get_all()
+async def get_menus(
+    page: Page = Depends(),
+    title: Optional[str] = Query(None, description='Часть названия меню'),
+    menu: MenuService = Depends(),
+):
+    """Возвращает страницу списка меню с количеством всех подменю и блюд.
+    Без `limit` возвращает весь список.
+    Следующая страница запрашивается с `after`, равным id последнего меню страницы"""
+    return await menu.get_all(page, title)
+
+
+@router.get(
+    '/menus/tree',
+    response_model=list[MenuTreeSchema],
+    status_code=HTTP_200_OK,
+    summary='Все меню с подменю и блюдами',
+)
+async def get_menu_trees(menu: MenuService = Depends()):
+    """Возвращает все меню с вложенными подменю и блюдами одним ответом"""
+    return await menu.get_trees()
+
+
+@router.get(
+    '/{menu_id}/tree',
+    response_model=MenuTreeSchema,
+    status_code=HTTP_200_OK,
+    summary='Меню с подменю и блюдами',
+    responses=RESPONSE_404,
+)
+async def get_menu_tree(menu_id: uuid.UUID, menu: MenuService = Depends()):
+    """Возвращает указанное меню с вложенными подменю и блюдами одним ответом"""
+    return await menu.get_tree(menu_id)
 
 
 @router.get(
@@ -66,9 +105,37 @@ async def fill_menus(menu: MenuService = Depends()):
 )
 async def generate_excel(menu: MenuService = Depends()):
     """Генерирует пример заполненного меню с подменю и блюдами.
-    При вызове возвращает id, по которому можно получить файл через эндпоинт get_excel
+    При вызове возвращает id, по которому можно получить файл через эндпоинт get_excel.
+    Пока меню не изменялись, возвращается id уже сформированного файла
     """
-    return await menu.generate_excel()
+    return await menu.generate_export(ExportFormat.xlsx)
+
+
+@router.post(
+    '/menus/generate_export',
+    status_code=HTTP_202_ACCEPTED,
+    summary='Сгенерировать файл с меню в указанном формате',
+)
+async def generate_export(export_format: ExportFormat, menu: MenuService = Depends()):
+    """Формирует файл со всеми меню, подменю и блюдами в формате xlsx, csv или ndjson.
+    При вызове возвращает id, по которому можно получить файл через эндпоинт get_export.
+    Пока меню не изменялись, возвращается id уже сформированного файла
+    """
+    return await menu.generate_export(export_format)
+
+
+@router.get(
+    '/menus/export',
+    status_code=HTTP_200_OK,
+    summary='Выгрузить меню в указанном формате',
+    responses={202: {'description': 'Accepted'}},
+)
+async def export(export_format: ExportFormat, menu: MenuService = Depends()):
+    """Возвращает все меню, подменю и блюда в формате csv или ndjson, по строке на блюдо.
+    Небольшие каталоги отдаются сразу по мере чтения из базы. Для больших каталогов и формата xlsx
+    файл формируется в фоне, возвращается его id, как в эндпоинте generate_export
+    """
+    return await menu.export(export_format)
 
 
 @router.get(
@@ -77,9 +144,48 @@ async def generate_excel(menu: MenuService = Depends()):
     status_code=HTTP_200_OK,
     summary='Скачать Меню.xlsx',
     responses=RESPONSE_404,
+    deprecated=True,
 )
 async def get_excel(file_id: uuid.UUID, menu: MenuService = Depends()):
-    """Возвращает Excel файл с текущими меню, подменю и блюдами.
-    Для получения файла требуется получить file_id в энпоинте gen_excel.
-    После выполнения сгенерированный файл удаляется с сервера"""
-    return await menu.get_excel(file_id)
+    """Устарел, псевдоним get_export: возвращает файл в формате, в котором он был сформирован,
+    Excel только для file_id из эндпоинта generate_excel. Используйте get_export"""
+    return await menu.get_export(file_id)
+
+
+@router.get(
+    '/menus/get_export',
+    response_class=FileResponse,
+    status_code=HTTP_200_OK,
+    summary='Скачать сформированный файл с меню',
+    responses=RESPONSE_404,
+)
+async def get_export(file_id: uuid.UUID, menu: MenuService = Depends()):
+    """Возвращает файл с меню, подменю и блюдами в формате, в котором он был сформирован.
+    Для получения файла требуется получить file_id в энпоинте generate_export"""
+    return await menu.get_export(file_id)
+
+
+@router.get(
+    '/menus/export_status',
+    response_model=ExportStatusSchema,
+    status_code=HTTP_200_OK,
+    summary='Статус формирования файла с меню',
+    responses=RESPONSE_404,
+)
+async def get_export_status(file_id: uuid.UUID, menu: MenuService = Depends()):
+    """Возвращает статус формирования файла: pending, running, done или failed,
+    и процент обработанных меню. Файл можно скачать, когда статус done"""
+    return await menu.get_export_status(file_id)
+
+
+@router.post(
+    '/batch',
+    response_model=MenuBatchResultSchema,
+    status_code=HTTP_200_OK,
+    summary='Пакетное изменение меню',
+    responses=RESPONSE_404,
+)
+async def batch_menus(batch: BatchSchema, menu: MenuService = Depends()):
+    """Создает, обновляет и удаляет меню одной транзакцией.
+    Если какое-либо из обновляемых или удаляемых меню не найдено, ничего не изменяется"""
+    return await menu.batch(batch)
@@ -1,11 +1,18 @@
 import uuid
+from typing import Optional
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Query
 from starlette.status import HTTP_200_OK, HTTP_201_CREATED
 
-from apps.menu.schemas import BaseSchema, SubmenuSchema
+from apps.menu.schemas import (
+    BaseSchema,
+    BatchSchema,
+    SubmenuBatchResultSchema,
+    SubmenuSchema,
+)
 from apps.menu.services import SubmenuService
 from core.openapi.responses import RESPONSE_303, RESPONSE_404
+from core.pagination import Page
 
 router = APIRouter(prefix='/menus/{menu_id}/submenus', tags=['submenu'])
 
@@ -16,9 +23,16 @@ router = APIRouter(prefix='/menus/{menu_id}/submenus', tags=['submenu'])
     status_code=HTTP_200_OK,
     summary='Список подменю',
 )
-async def get_submenus(menu_id: uuid.UUID, submenu: SubmenuService = Depends()):
-    """Возвращает список всех подменю с количеством всех блюд"""
-    return await submenu.get_all(menu_id)
+async def get_submenus(
+    menu_id: uuid.UUID,
+    page: Page = Depends(),
+    title: Optional[str] = Query(None, description='Часть названия подменю'),
+    submenu: SubmenuService = Depends(),
+):
+    """Возвращает страницу списка подменю с количеством всех блюд.
+    Без `limit` возвращает весь список.
+    Следующая страница запрашивается с `after`, равным id последнего подменю страницы"""
+    return await submenu.get_all(menu_id, page, title)
 
 
 @router.get(
@@ -56,3 +70,16 @@ async def update_submenu(
 ):
     """Обновляет указанное меню"""
     return await submenu.update(submenu_id, submenu_data, menu_id)
+
+
+@router.post(
+    '/batch',
+    response_model=SubmenuBatchResultSchema,
+    status_code=HTTP_200_OK,
+    summary='Пакетное изменение подменю',
+    responses=RESPONSE_404,
+)
+async def batch_submenus(menu_id: uuid.UUID, batch: BatchSchema, submenu: SubmenuService = Depends()):
+    """Создает, обновляет и удаляет подменю указанного меню одной транзакцией.
+    Если какое-либо из обновляемых или удаляемых подменю не найдено, ничего не изменяется"""
+    return await submenu.batch(batch, menu_id)
@@ -0,0 +1,122 @@
+"""Cache keys of menu reads and the dependency rules between them.
+
+Every cached read is tagged with the parts of the menu tree it shows,
+every write invalidates the tags of the parts it changes:
+
+    menus                       list of menus with their counts
+    menu:{menu_id}              menu with its counts
+    menu:{menu_id}:submenus     list of submenus of the menu with their counts
+    submenu:{submenu_id}        submenu with its count
+    submenu:{submenu_id}:dishes list of dishes of the submenu
+    dish:{dish_id}              dish
+    *:subtree                   anything below the menu/submenu, dropped when it is deleted
+    menu:{menu_id}:tree         menu with all its submenus and dishes, dropped by any write below the menu
+    catalog                     anything read from all menus, e.g. the whole tree or dish search results,
+                                dropped by any write
+
+Creating and deleting submenus and dishes doesn't drop the entries holding their
+counts, the counters are changed in place instead.
+"""
+
+MENUS = 'menus'
+MENU = 'menu:{menu_id}'
+MENU_SUBMENUS = 'menu:{menu_id}:submenus'
+MENU_SUBTREE = 'menu:{menu_id}:subtree'
+SUBMENU = 'submenu:{submenu_id}'
+SUBMENU_DISHES = 'submenu:{submenu_id}:dishes'
+SUBMENU_SUBTREE = 'submenu:{submenu_id}:subtree'
+DISH = 'dish:{dish_id}'
+MENU_TREE = 'menu:{menu_id}:tree'
+CATALOG = 'catalog'
+
+# pages of the lists are cached independently, see core.pagination.Page.
+# Filtered lists are not cached, any client could fill the cache with one-off filters
+MENU_LIST_KEY = 'menus?{page}'
+MENU_LIST_TAGS = (MENUS,)
+MENU_KEY = 'menus:{menu_id}'
+MENU_TAGS = (MENU,)
+SUBMENU_LIST_KEY = 'menus:{menu_id}:submenus?{page}'
+SUBMENU_LIST_TAGS = (MENU_SUBMENUS,)
+SUBMENU_KEY = 'menus:{menu_id}:submenus:{submenu_id}'
+SUBMENU_TAGS = (SUBMENU, MENU_SUBTREE)
+DISH_LIST_KEY = 'menus:{menu_id}:submenus:{submenu_id}:dishes?{page}'
+DISH_LIST_TAGS = (SUBMENU_DISHES, MENU_SUBTREE)
+DISH_KEY = 'menus:{menu_id}:submenus:{submenu_id}:dishes:{dish_id}'
+DISH_TAGS = (DISH, SUBMENU_SUBTREE, MENU_SUBTREE)
+MENU_TREE_KEY = 'menus:{menu_id}:tree'
+MENU_TREE_TAGS = (MENU_TREE,)
+CATALOG_TREE_KEY = 'menus:tree'
+CATALOG_TREE_TAGS = (CATALOG,)
+# only popular queries are cached, like filtered lists one-off queries would fill the cache.
+# The searches of a query are counted under the hits key
+DISH_SEARCH_KEY = 'dishes:search?q={terms}&{page}'
+DISH_SEARCH_TAGS = (CATALOG,)
+DISH_SEARCH_HITS_KEY = 'dishes:search:hits?q={terms}'
+# id of the export of the catalog at the version of the catalog tag, every write changes it
+EXPORT_KEY = 'exports:{export_format}:{version}'
+# export started with the id, the status of ids never started is not known
+EXPORT_JOB_KEY = 'export_jobs:{file_id}'
+
+# entries holding counts of the menu and of the submenu: (tag, item id)
+MENU_COUNTED = ((MENUS, '{menu_id}'), (MENU, '{menu_id}'))
+SUBMENU_COUNTED = ((MENU_SUBMENUS, '{submenu_id}'), (SUBMENU, '{submenu_id}'))
+
+
+def _counters(counted: tuple, counter: str, change) -> tuple:
+    return tuple((tag, item_id, counter, change) for tag, item_id in counted)
+
+
+def _changed(template: str, id_argument: str, deleted_only: bool = False):
+    """Tags of the items updated and deleted by a batch, other placeholders are filled from the arguments"""
+    def tags(batch) -> list[str]:
+        ids = list(batch.deleted) if deleted_only else [*(item.id for item in batch.updated), *batch.deleted]
+        return [template.replace(f'{{{id_argument}}}', str(item_id)) for item_id in ids]
+    return tags
+
+
+def _created_count(batch) -> int:
+    return len(batch.created) - len(batch.deleted)
+
+
+# trees are not changed in place, any write below them drops them
+TREES = (MENU_TREE, CATALOG)
+
+MENU_CREATED = (MENUS, CATALOG)
+MENU_UPDATED = (MENUS, MENU, *TREES)
+MENU_DELETED = (MENUS, MENU, MENU_SUBMENUS, MENU_SUBTREE, *TREES)
+SUBMENU_CREATED = (MENU_SUBMENUS, *TREES)
+SUBMENU_CREATED_COUNTERS = _counters(MENU_COUNTED, 'submenus_count', 1)
+SUBMENU_UPDATED = (MENU_SUBMENUS, SUBMENU, *TREES)
+SUBMENU_DELETED = (MENU_SUBMENUS, SUBMENU, SUBMENU_DISHES, SUBMENU_SUBTREE, *TREES)
+SUBMENU_DELETED_COUNTERS = (
+    *_counters(MENU_COUNTED, 'submenus_count', -1),
+    *_counters(MENU_COUNTED, 'dishes_count', lambda submenu: -submenu.dishes_count),
+)
+DISH_CREATED = (SUBMENU_DISHES, *TREES)
+DISH_CREATED_COUNTERS = _counters(MENU_COUNTED + SUBMENU_COUNTED, 'dishes_count', 1)
+DISH_UPDATED = (SUBMENU_DISHES, DISH, *TREES)
+DISH_DELETED = (SUBMENU_DISHES, DISH, *TREES)
+DISH_DELETED_COUNTERS = _counters(MENU_COUNTED + SUBMENU_COUNTED, 'dishes_count', -1)
+
+# a batch is invalidated once, with the tags of all the items it changes
+MENU_BATCH = (
+    MENUS,
+    CATALOG,
+    _changed(MENU, 'menu_id'),
+    _changed(MENU_TREE, 'menu_id'),
+    _changed(MENU_SUBMENUS, 'menu_id', deleted_only=True),
+    _changed(MENU_SUBTREE, 'menu_id', deleted_only=True),
+)
+SUBMENU_BATCH = (
+    MENU_SUBMENUS,
+    *TREES,
+    _changed(SUBMENU, 'submenu_id'),
+    _changed(SUBMENU_DISHES, 'submenu_id', deleted_only=True),
+    _changed(SUBMENU_SUBTREE, 'submenu_id', deleted_only=True),
+)
+SUBMENU_BATCH_COUNTERS = (
+    *_counters(MENU_COUNTED, 'submenus_count', _created_count),
+    *_counters(MENU_COUNTED, 'dishes_count', lambda batch: -batch.dishes_deleted),
+)
+DISH_BATCH = (SUBMENU_DISHES, *TREES, _changed(DISH, 'dish_id'))
+DISH_BATCH_COUNTERS = _counters(MENU_COUNTED + SUBMENU_COUNTED, 'dishes_count', _created_count)
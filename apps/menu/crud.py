@@ -1,23 +1,138 @@
-import json
 import os
-import pickle
+import uuid
+from decimal import Decimal
+from typing import NamedTuple, Optional, Union
+from urllib.parse import quote
 from uuid import UUID
 
+import ijson
+from celery import states
 from fastapi import Depends, HTTPException
-from sqlalchemy import distinct, func, insert, select, update
-from sqlalchemy.engine import CursorResult
+from sqlalchemy import (
+    and_,
+    bindparam,
+    cast,
+    delete,
+    func,
+    insert,
+    literal_column,
+    or_,
+    select,
+    update,
+)
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.engine import Row
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import joinedload
+from sqlalchemy.orm import aliased, contains_eager
+from sqlalchemy.sql import Select
+from sqlalchemy.sql.selectable import TableValuedAlias
 from starlette import status
-from starlette.background import BackgroundTask
-from starlette.responses import FileResponse
-
-from core.database import Session, get_session
-from core.settings import GENERATED_FILES_DIRNAME
-
-from .models import Dish, Menu, Submenu
-from .schemas import BaseSchema
-from .tasks import gen_excel_task
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+from starlette.responses import FileResponse, StreamingResponse
+
+from core.database import Base, Session, get_session
+from core.pagination import Page, paginate
+from core.settings import GENERATED_FILES_DIRNAME, PAGE_SIZE
+
+from .exporters import EXPORTERS, Exporter, StreamingExporter, catalog_rows
+from .models import SEARCH_CONFIG, Dish, Menu, Submenu
+from .schemas import (
+    BaseSchema,
+    BatchSchema,
+    DishBatchSchema,
+    ExportFormat,
+    ExportStatus,
+    ExportStatusSchema,
+)
+from .tasks import PROGRESS, gen_export_task
+
+# dishes parsed before they are inserted
+BULK_INSERT_SIZE = 10000
+
+
+class BatchResult(NamedTuple):
+    created: list
+    updated: list
+    # ids
+    deleted: list
+    # dishes of the deleted submenus, deleted by the cascade
+    dishes_deleted: int = 0
+
+
+def unnest(rows: list[dict], columns: list) -> TableValuedAlias:
+    """The rows as a table of unnest(arrays), one parameter per column whatever the number of rows"""
+    return func.unnest(*[
+        # parameters named as columns are reserved by INSERT and UPDATE
+        cast(bindparam(f'{column.name}_values', [row[column.name] for row in rows]), ARRAY(column.type))
+        for column in columns
+    ]).table_valued(*[column.name for column in columns]).render_derived()
+
+
+def returned_columns(model: type[Base]) -> list:
+    # generated columns are left to the database
+    return [column for column in model.__table__.columns if column.computed is None]
+
+
+async def write_returning(session: AsyncSession, model: type[Base], statement, not_found: str) -> Base:
+    """Runs the INSERT, UPDATE or DELETE of one item with RETURNING and commits it: one statement,
+    the response is made of what the database stored. No returned row means the item is not found"""
+    row = (await session.execute(statement.returning(*returned_columns(model)))).first()
+    if row is None:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, detail=not_found)
+    await session.commit()
+    return model(**row._mapping)
+
+
+async def apply_batch(
+        session: AsyncSession,
+        model: type[Base],
+        batch: Union[BatchSchema, DishBatchSchema],
+        parent: dict,
+        not_found: str) -> BatchResult:
+    """Creates, updates and deletes the items of the parent with one set-based statement each and commits once.
+    Nothing is changed if any of the updated or deleted items is not found"""
+    columns = returned_columns(model)
+    criteria = [getattr(model, name) == value for name, value in parent.items()]
+    created = updated = deleted = []
+
+    if batch.create:
+        rows = [{**item.dict(), **parent, 'id': uuid.uuid4()} for item in batch.create]
+        values = unnest(rows, [model.__table__.c[name] for name in rows[0]])
+        result = await session.execute(
+            insert(model).from_select(list(rows[0]), select(values)).returning(*columns)
+        )
+        created = result.all()
+    if batch.update:
+        rows = [item.dict() for item in batch.update]
+        values = unnest(rows, [model.__table__.c[name] for name in rows[0]])
+        result = await session.execute(
+            update(model)
+            .where(model.id == values.c.id, *criteria)
+            .values({name: values.c[name] for name in rows[0] if name != 'id'})
+            .returning(*columns)
+            # items loaded in the session are not matched against the unnested rows, reads refresh them
+            .execution_options(synchronize_session=False)
+        )
+        updated = result.all()
+        if len(updated) != len(rows):
+            raise HTTPException(status.HTTP_404_NOT_FOUND, detail=not_found)
+    if batch.delete:
+        result = await session.execute(
+            delete(model)
+            .where(model.id.in_(batch.delete), *criteria)
+            .returning(*columns)
+            .execution_options(synchronize_session=False)
+        )
+        deleted = result.all()
+        if len(deleted) != len(batch.delete):
+            raise HTTPException(status.HTTP_404_NOT_FOUND, detail=not_found)
+    await session.commit()
+    return BatchResult(
+        created=created,
+        updated=updated,
+        deleted=[item.id for item in deleted],
+        dishes_deleted=sum(item.dishes_count for item in deleted) if model is Submenu else 0,
+    )
 
 
 class MenuCRUD:
@@ -26,68 +141,64 @@ class MenuCRUD:
         self.model: type[Menu] = Menu
 
     # @cache
-    async def get_all(self) -> list[Menu]:
-        query = await self.session.execute(
-            select(
-                Menu.id,
-                Menu.title,
-                Menu.description,
-                func.count(distinct(Submenu.id)).label('submenus_count'),
-                func.count(distinct(Dish.id)).label('dishes_count'),
-            )
-            .outerjoin(Submenu, Menu.id == Submenu.menu_id)
-            .outerjoin(Dish, Submenu.id == Dish.submenu_id)
-            .group_by(Menu.id)
+    async def get_all(self, page: Optional[Page] = None, title: Optional[str] = None) -> list[Menu]:
+        items = await self.session.scalars(
+            paginate(select(Menu), Menu, page, title).execution_options(populate_existing=True)
         )
-        return query.all()
+        return items.all()
 
     # @cache
     async def get_by_id(self, menu_id: UUID) -> Menu:
-        query = await self.session.execute(
-            select(
-                Menu.id,
-                Menu.title,
-                Menu.description,
-                func.count(distinct(Submenu.id)).label('submenus_count'),
-                func.count(distinct(Dish.id)).label('dishes_count'),
-            )
-            .outerjoin(Submenu, Menu.id == Submenu.menu_id)
-            .outerjoin(Dish, Submenu.id == Dish.submenu_id)
-            .filter(Menu.id == menu_id)
-            .group_by(Menu.id)
-        )
+        return await self._get(menu_id)
 
-        item: Menu = query.first()
+    async def get_tree(self, menu_id: UUID) -> Menu:
+        items = await self.session.scalars(self._tree_query().filter(Menu.id == menu_id))
+        item = items.unique().first()
         if not item:
             raise HTTPException(status.HTTP_404_NOT_FOUND,
                                 detail='menu not found')
         return item
 
+    async def get_trees(self) -> list[Menu]:
+        items = await self.session.scalars(self._tree_query())
+        return items.unique().all()
+
+    @staticmethod
+    def _tree_query() -> Select:
+        # one query for the whole tree, loaded items are refreshed as counts are changed by the database
+        return (
+            select(Menu)
+            .outerjoin(Menu.submenus)
+            .outerjoin(Submenu.dishes)
+            .options(contains_eager(Menu.submenus).contains_eager(Submenu.dishes))
+            .order_by(Menu.id, Submenu.id, Dish.id)
+            .execution_options(populate_existing=True)
+        )
+
     # @cache
     async def create(self, item_data: BaseSchema) -> Menu:
-        cursor_result: CursorResult = await self.session.execute(insert(Menu).values(**item_data.dict()))
-        await self.session.commit()
-        item = self.model(**cursor_result.context.compiled_parameters[0])
-        return item
+        return await write_returning(self.session, Menu, insert(Menu).values(**item_data.dict()), 'menu not found')
 
     # @cache
     async def update(self, item_id: UUID, item_data: BaseSchema) -> Menu:
-        item = await self._get(item_id)
-        await self.session.execute(update(self.model).filter_by(id=item_id).values(**item_data.dict()))
-        await self.session.commit()
-        await self.session.refresh(item)
-
-        return item
+        return await write_returning(
+            self.session,
+            Menu,
+            update(Menu).filter_by(id=item_id).values(**item_data.dict()),
+            'menu not found',
+        )
 
     # @cache
     async def delete(self, item_id: UUID) -> Menu:
-        item = await self._get(item_id)
-        await self.session.delete(item)
-        await self.session.commit()
-        return item
+        # submenus and dishes are deleted by the cascade of the foreign keys
+        return await write_returning(self.session, Menu, delete(Menu).filter_by(id=item_id), 'menu not found')
+
+    async def batch(self, batch: BatchSchema) -> BatchResult:
+        return await apply_batch(self.session, Menu, batch, {}, 'menu not found')
 
     async def _get(self, item_id: UUID) -> Menu:
-        item = await self.session.get(self.model, item_id)
+        # counts are changed by the database, loaded items are refreshed
+        item = await self.session.get(self.model, item_id, populate_existing=True)
         if not item:
             raise HTTPException(status.HTTP_404_NOT_FOUND,
                                 detail='menu not found')
@@ -95,62 +206,92 @@ class MenuCRUD:
 
     # @cache
     async def create_example(self, file_path: str) -> dict:
-        pass
-        with open(file_path, encoding='utf8') as file:
-            example_data = json.load(file)
-        for menu in example_data.values():
-            new_menu = await self.session.execute(
-                insert(Menu).values(title=menu.get('title'),
-                                    description=menu.get('description'))
-            )
-            menu_id = new_menu.inserted_primary_key[0].hex
-            for submenu in menu.get('submenus').values():
-                new_submenu = await self.session.execute(
-                    insert(Submenu).values(
-                        title=submenu.get('title'),
-                        description=submenu.get('description'),
-                        menu_id=menu_id,
-                    )
-                )
-                submenu_id = new_submenu.inserted_primary_key[0].hex
-                for dish in submenu.get('dishes').values():
-                    await self.session.execute(
-                        insert(Dish).values(
-                            title=dish.get('title'),
-                            description=dish.get('description'),
-                            price=dish.get('price'),
-                            submenu_id=submenu_id,
-                        )
-                    )
+        menus: list[dict] = []
+        submenus: list[dict] = []
+        dishes: list[dict] = []
+        with open(file_path, 'rb') as file:
+            # menus are parsed one at a time in a thread, the file is never loaded whole
+            async for _, menu in iterate_in_threadpool(ijson.kvitems(file, '')):
+                menu_id = uuid.uuid4()
+                menus.append({'id': menu_id, 'title': menu.get('title'), 'description': menu.get('description')})
+                for submenu in menu.get('submenus', {}).values():
+                    submenu_id = uuid.uuid4()
+                    submenus.append({
+                        'id': submenu_id,
+                        'title': submenu.get('title'),
+                        'description': submenu.get('description'),
+                        'menu_id': menu_id,
+                    })
+                    for dish in submenu.get('dishes', {}).values():
+                        dishes.append({
+                            'id': uuid.uuid4(),
+                            'title': dish.get('title'),
+                            'description': dish.get('description'),
+                            'price': dish.get('price'),
+                            'submenu_id': submenu_id,
+                        })
+                if len(dishes) >= BULK_INSERT_SIZE:
+                    await self._bulk_insert((Menu, menus), (Submenu, submenus), (Dish, dishes))
+        await self._bulk_insert((Menu, menus), (Submenu, submenus), (Dish, dishes))
         await self.session.commit()
         return {'message': 'database filled'}
 
-    async def generate_excel(self) -> dict:
-        query = await self.session.scalars(select(Menu).options(joinedload('submenus'), joinedload('submenus.dishes')))
-        full_menus_data = query.unique().all()
-        # q = jsonable_encoder(full_menus_data)
-        task = gen_excel_task.apply_async(
-            (pickle.dumps(full_menus_data),), serializer='pickle')
-
-        return {'file_id': task.id}
-
-    async def get_excel(self, file_id: UUID) -> FileResponse:
-        file_name = f'{file_id}.xlsx'
-        file_path = os.path.join(GENERATED_FILES_DIRNAME, file_name)
-        if not os.path.exists(file_path):
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND, detail='file not found')
-
-        return FileResponse(
-            path=file_path,
-            filename='Меню.xlsx',
-            media_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-            background=BackgroundTask(self.cleanup, file_path),
+    async def _bulk_insert(self, *tables: tuple[type[Base], list[dict]]) -> None:
+        """Inserts the rows of every table with a single INSERT ... SELECT FROM unnest(arrays) and clears them,
+        parents go first. The statement has one parameter per column whatever the number of rows"""
+        for model, rows in tables:
+            if not rows:
+                continue
+            columns = [column for column in model.__table__.columns if column.name in rows[0]]
+            await self.session.execute(insert(model).from_select(columns, select(unnest(rows, columns))))
+            rows.clear()
+
+    async def generate_export(self, file_id: str, export_format: ExportFormat) -> dict:
+        # the worker reads the menus itself, only the task id goes through the broker
+        gen_export_task.apply_async((export_format.value,), task_id=file_id)
+        return {'file_id': file_id}
+
+    async def stream_export(self, export_format: ExportFormat) -> StreamingResponse:
+        exporter = EXPORTERS[export_format]
+        if not isinstance(exporter, StreamingExporter):
+            raise ValueError(f'{export_format.value} export can only be saved to a file')
+        return StreamingResponse(
+            exporter.encode(catalog_rows(self.session)),
+            media_type=exporter.media_type,
+            headers={'Content-Disposition': f"attachment; filename*=utf-8''{quote(f'Меню.{exporter.extension}')}"},
         )
 
+    async def count_dishes(self) -> int:
+        return await self.session.scalar(select(func.coalesce(func.sum(Menu.dishes_count), 0)))
+
+    async def get_export(self, file_id: UUID) -> FileResponse:
+        for exporter in EXPORTERS.values():
+            file_path = self._export_path(file_id, exporter)
+            if os.path.exists(file_path):
+                return FileResponse(
+                    path=file_path,
+                    filename=f'Меню.{exporter.extension}',
+                    media_type=exporter.media_type,
+                )
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail='file not found')
+
+    async def get_export_status(self, file_id: str) -> ExportStatusSchema:
+        if any(os.path.exists(self._export_path(file_id, exporter)) for exporter in EXPORTERS.values()):
+            return ExportStatusSchema(file_id=file_id, status=ExportStatus.done, progress=100)
+        # the result backend client is blocking
+        meta = await run_in_threadpool(gen_export_task.backend.get_task_meta, file_id)
+        if meta['status'] in (PROGRESS, states.STARTED):
+            progress = meta['result'].get('progress', 0) if meta['status'] == PROGRESS else 0
+            return ExportStatusSchema(file_id=file_id, status=ExportStatus.running, progress=progress)
+        if meta['status'] == states.PENDING:
+            return ExportStatusSchema(file_id=file_id, status=ExportStatus.pending)
+        # failed, revoked or finished but the file has expired since
+        return ExportStatusSchema(file_id=file_id, status=ExportStatus.failed)
+
     @staticmethod
-    def cleanup(file_path):
-        os.remove(file_path)
+    def _export_path(file_id: Union[UUID, str], exporter: Exporter) -> str:
+        return os.path.join(GENERATED_FILES_DIRNAME, f'{file_id}.{exporter.extension}')
 
 
 class SubmenuCRUD:
@@ -159,66 +300,51 @@ class SubmenuCRUD:
         self.model: type[Submenu] = Submenu
 
     # @cache
-    async def get_all(self, menu_id: UUID) -> list[Submenu]:
-        query = await self.session.execute(
-            select(
-                Submenu.id,
-                Submenu.title,
-                Submenu.description,
-                func.count(distinct(Dish.id)).label('dishes_count'),
-            )
-            .outerjoin(Dish, Submenu.id == Dish.submenu_id)
-            .filter(Submenu.menu_id == menu_id)
-            .group_by(Submenu.id)
+    async def get_all(self, menu_id: UUID, page: Optional[Page] = None, title: Optional[str] = None) -> list[Submenu]:
+        items = await self.session.scalars(
+            paginate(select(Submenu).filter(Submenu.menu_id == menu_id), Submenu, page, title)
+            .execution_options(populate_existing=True)
         )
-        return query.all()
+        return items.all()
 
     # @cache
     async def get_by_id(self, submenu_id: UUID, menu_id: UUID) -> Submenu:
-        query = await self.session.execute(
-            select(
-                Submenu.id,
-                Submenu.title,
-                Submenu.description,
-                func.count(distinct(Dish.id)).label('dishes_count'),
-            )
-            .outerjoin(Dish, Submenu.id == Dish.submenu_id)
-            .filter(Submenu.menu_id == menu_id)
-            .filter(Submenu.id == submenu_id)
-            .group_by(Submenu.id)
-        )
-        item = query.first()
-        if not item:
-            raise HTTPException(status.HTTP_404_NOT_FOUND,
-                                detail='submenu not found')
-        return item
+        return await self._get(submenu_id, menu_id)
 
     # @cache
     async def create(self, item_data: BaseSchema, menu_id: UUID) -> Submenu:
-        cursor_result = await self.session.execute(insert(self.model).values(**item_data.dict(), menu_id=menu_id))
-        await self.session.commit()
-        item = self.model(**cursor_result.context.compiled_parameters[0])
-        return item
+        return await write_returning(
+            self.session,
+            Submenu,
+            insert(Submenu).values(**item_data.dict(), menu_id=menu_id),
+            'submenu not found',
+        )
 
     # @cache
-    async def delete(self, item_id: UUID, menu_id: UUID):
-        item = await self._get(item_id, menu_id)
-        await self.session.delete(item)
-        await self.session.commit()
-        return item
+    async def delete(self, item_id: UUID, menu_id: UUID) -> Submenu:
+        # the returned dishes count is needed to update cached counts of the menu
+        return await write_returning(
+            self.session,
+            Submenu,
+            delete(Submenu).filter_by(id=item_id, menu_id=menu_id),
+            'submenu not found',
+        )
 
     # @cache
     async def update(self, item_id: UUID, item_data: BaseSchema, menu_id: UUID) -> Submenu:
-        item = await self._get(item_id, menu_id)
-        await self.session.execute(update(self.model).filter_by(id=item_id, menu_id=menu_id).values(**item_data.dict()))
-        await self.session.commit()
-        await self.session.refresh(item)
-        return item
+        return await write_returning(
+            self.session,
+            Submenu,
+            update(Submenu).filter_by(id=item_id, menu_id=menu_id).values(**item_data.dict()),
+            'submenu not found',
+        )
+
+    async def batch(self, batch: BatchSchema, menu_id: UUID) -> BatchResult:
+        return await apply_batch(self.session, Submenu, batch, {'menu_id': menu_id}, 'submenu not found')
 
     async def _get(self, submenu_id: UUID, menu_id: UUID) -> Submenu:
         item = await self.session.scalar(
-            select(Submenu).filter(Submenu.id == submenu_id).filter(
-                Menu.id == menu_id).join(Menu, Menu.id == menu_id)
+            select(Submenu).filter_by(id=submenu_id, menu_id=menu_id).execution_options(populate_existing=True)
         )
         if not item:
             raise HTTPException(status.HTTP_404_NOT_FOUND,
@@ -232,38 +358,75 @@ class DishCRUD:
         self.model: type[Dish] = Dish
 
     # @cache
-    async def get_all(self, submenu_id: UUID) -> list[Dish]:
-        items = await self.session.scalars(select(Dish).filter(Dish.submenu_id == submenu_id))
+    async def get_all(
+            self,
+            submenu_id: UUID,
+            page: Optional[Page] = None,
+            title: Optional[str] = None,
+            min_price: Optional[Decimal] = None,
+            max_price: Optional[Decimal] = None) -> list[Dish]:
+        query = select(Dish).filter(Dish.submenu_id == submenu_id)
+        if min_price is not None:
+            query = query.filter(Dish.price >= min_price)
+        if max_price is not None:
+            query = query.filter(Dish.price <= max_price)
+        items = await self.session.scalars(paginate(query, Dish, page, title))
         return items.all()
 
+    async def search(self, terms: str, page: Page) -> list[Row]:
+        """Dishes of all menus matching every term as a prefix of a word, best ranked first.
+        Pages are ordered by rank and id, the page after a dish starts below its rank"""
+        query = func.to_tsquery(
+            literal_column(f"'{SEARCH_CONFIG}'::regconfig"), ' & '.join(f'{term}:*' for term in terms.split())
+        )
+        rank = func.ts_rank(Dish.search_vector, query)
+        statement = (
+            select(Dish.id, Dish.title, Dish.description, Dish.price, Dish.submenu_id, Submenu.menu_id)
+            .join(Submenu, Dish.submenu_id == Submenu.id)
+            .filter(Dish.search_vector.op('@@')(query))
+        )
+        if page.after is not None:
+            after = aliased(Dish)
+            after_rank = (
+                select(func.ts_rank(after.search_vector, query)).filter(after.id == page.after).scalar_subquery()
+            )
+            statement = statement.filter(or_(rank < after_rank, and_(rank == after_rank, Dish.id > page.after)))
+        result = await self.session.execute(statement.order_by(rank.desc(), Dish.id).limit(page.limit or PAGE_SIZE))
+        return result.all()
+
     # @cache
     async def get_by_id(self, dish_id: UUID, submenu_id: UUID) -> Dish:
         return await self._get(dish_id, submenu_id)
 
     # @cache
     async def create(self, item_data: BaseSchema, submenu_id: UUID, *args, **kwargs) -> Dish:
-        cursor_result = await self.session.execute(insert(self.model).values(**item_data.dict(), submenu_id=submenu_id))
-        await self.session.commit()
-        item = self.model(**cursor_result.context.compiled_parameters[0])
-        return item
+        return await write_returning(
+            self.session,
+            Dish,
+            insert(Dish).values(**item_data.dict(), submenu_id=submenu_id),
+            'dish not found',
+        )
 
     # @cache
-    async def delete(self, item_id: UUID, submenu_id: UUID, *args, **kwargs):
-        item = await self._get(item_id, submenu_id)
-        await self.session.delete(item)
-        await self.session.commit()
-        return item
+    async def delete(self, item_id: UUID, submenu_id: UUID, *args, **kwargs) -> Dish:
+        return await write_returning(
+            self.session,
+            Dish,
+            delete(Dish).filter_by(id=item_id, submenu_id=submenu_id),
+            'dish not found',
+        )
 
     # @cache
     async def update(self, item_id: UUID, item_data: BaseSchema, submenu_id: UUID) -> Dish:
-        item = await self._get(item_id, submenu_id)
-        await self.session.execute(
-            update(self.model).filter_by(
-                id=item_id, submenu_id=submenu_id).values(**item_data.dict())
+        return await write_returning(
+            self.session,
+            Dish,
+            update(Dish).filter_by(id=item_id, submenu_id=submenu_id).values(**item_data.dict()),
+            'dish not found',
         )
-        await self.session.commit()
-        await self.session.refresh(item)
-        return item
+
+    async def batch(self, batch: DishBatchSchema, submenu_id: UUID) -> BatchResult:
+        return await apply_batch(self.session, Dish, batch, {'submenu_id': submenu_id}, 'dish not found')
 
     async def _get(self, dish_id: UUID, submenu_id: UUID) -> Dish:
         dish: Dish = await self.session.scalar(
@@ -0,0 +1,156 @@
+import csv
+import io
+import json
+import os
+from abc import ABC, abstractmethod
+from typing import AsyncIterator, Callable, Optional, Sequence
+
+from openpyxl import Workbook
+from sqlalchemy import func, select
+from sqlalchemy.engine import Row
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .models import Dish, Menu, Submenu
+from .schemas import ExportFormat
+
+# rows fetched from the server-side cursor at a time
+EXPORT_BATCH_SIZE = 1000
+
+# columns of the tables, the mapped attributes are annotated with the types of their values
+CATALOG_COLUMNS = (
+    Menu.__table__.c.id.label('menu_id'),
+    Menu.__table__.c.title.label('menu_title'),
+    Menu.__table__.c.description.label('menu_description'),
+    Submenu.__table__.c.id.label('submenu_id'),
+    Submenu.__table__.c.title.label('submenu_title'),
+    Submenu.__table__.c.description.label('submenu_description'),
+    Dish.__table__.c.id.label('dish_id'),
+    Dish.__table__.c.title.label('dish_title'),
+    Dish.__table__.c.description.label('dish_description'),
+    Dish.__table__.c.price.label('dish_price'),
+)
+
+Batches = AsyncIterator[Sequence[Row]]
+
+
+async def catalog_rows(session: AsyncSession, on_progress: Optional[Callable[[int], None]] = None) -> Batches:
+    """Batches of rows of the menus outer joined with their submenus and dishes, ordered by menu, submenu and dish.
+    `on_progress` is called with the percentage of the menus read whenever it grows"""
+    menus_count = await session.scalar(select(func.count()).select_from(Menu))
+    result = await session.stream(
+        select(*CATALOG_COLUMNS)
+        .outerjoin(Submenu, Menu.id == Submenu.menu_id)
+        .outerjoin(Dish, Submenu.id == Dish.submenu_id)
+        .order_by(Menu.id, Submenu.id, Dish.id)
+        .execution_options(yield_per=EXPORT_BATCH_SIZE)
+    )
+    menu_id = None
+    menus_read = progress = 0
+    async for rows in result.partitions():
+        yield rows
+        if on_progress is None:
+            continue
+        for row in rows:
+            if row.menu_id != menu_id:
+                menu_id = row.menu_id
+                menus_read += 1
+        # the last menu of the batch may go on in the next one
+        if (menus_read - 1) * 100 // menus_count > progress:
+            progress = (menus_read - 1) * 100 // menus_count
+            on_progress(progress)
+
+
+class Exporter(ABC):
+    """Saves the catalog rows to a file in a format"""
+    extension: str
+    media_type: str
+
+    @abstractmethod
+    async def save(self, batches: Batches, file_path: str) -> None:
+        ...
+
+
+class StreamingExporter(Exporter):
+    """Writes the catalog rows line by line, so that they can be streamed as well as saved"""
+
+    @abstractmethod
+    def encode(self, batches: Batches) -> AsyncIterator[bytes]:
+        ...
+
+    async def save(self, batches: Batches, file_path: str) -> None:
+        # the file appears under its name only when it is complete
+        with open(f'{file_path}.part', 'wb') as file:
+            async for chunk in self.encode(batches):
+                file.write(chunk)
+        os.replace(f'{file_path}.part', file_path)
+
+
+class CsvExporter(StreamingExporter):
+    extension = 'csv'
+    media_type = 'text/csv'
+
+    async def encode(self, batches: Batches) -> AsyncIterator[bytes]:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(column.name for column in CATALOG_COLUMNS)
+        async for rows in batches:
+            writer.writerows(rows)
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue().encode()
+
+
+class NdjsonExporter(StreamingExporter):
+    extension = 'ndjson'
+    media_type = 'application/x-ndjson'
+
+    async def encode(self, batches: Batches) -> AsyncIterator[bytes]:
+        async for rows in batches:
+            # ids and prices are strings, as in the API
+            yield ''.join(
+                json.dumps(dict(row._mapping), ensure_ascii=False, default=str) + '\n' for row in rows
+            ).encode()
+
+
+class ExcelExporter(Exporter):
+    """Menus, submenus and dishes numbered under each other, as the workbook is meant to be read by people.
+    A workbook is a zip archive, it can only be saved to a file"""
+    extension = 'xlsx'
+    media_type = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+    async def save(self, batches: Batches, file_path: str) -> None:
+        workbook = Workbook(write_only=True)
+        worksheet = workbook.create_sheet()
+        empty_cell = ''
+        column_dimensions = {'A': 5, 'B': 12, 'C': 25, 'D': 30, 'E': 70, 'F': 10}
+
+        for col, value in column_dimensions.items():
+            worksheet.column_dimensions[col].width = value
+
+        menu_id = submenu_id = None
+        m_num = s_num = d_num = 0
+        async for rows in batches:
+            for row in rows:
+                if row.menu_id != menu_id:
+                    menu_id, submenu_id = row.menu_id, None
+                    m_num, s_num = m_num + 1, 0
+                    worksheet.append([m_num, row.menu_title, row.menu_description])
+                if row.submenu_id is not None and row.submenu_id != submenu_id:
+                    submenu_id = row.submenu_id
+                    s_num, d_num = s_num + 1, 0
+                    worksheet.append([empty_cell, s_num, row.submenu_title, row.submenu_description])
+                if row.dish_id is not None:
+                    d_num += 1
+                    worksheet.append(
+                        [empty_cell, empty_cell, d_num, row.dish_title, row.dish_description, row.dish_price])
+
+        workbook.save(f'{file_path}.part')
+        os.replace(f'{file_path}.part', file_path)
+
+
+EXPORTERS: dict[ExportFormat, Exporter] = {
+    ExportFormat.xlsx: ExcelExporter(),
+    ExportFormat.csv: CsvExporter(),
+    ExportFormat.ndjson: NdjsonExporter(),
+}
@@ -1,9 +1,19 @@
 import uuid
 from decimal import Decimal
 
-from sqlalchemy import Column, ForeignKey, Numeric, String
-from sqlalchemy.dialects.postgresql import UUID
-from sqlalchemy.orm import relationship
+from sqlalchemy import (
+    DDL,
+    Column,
+    Computed,
+    ForeignKey,
+    Index,
+    Integer,
+    Numeric,
+    String,
+    event,
+)
+from sqlalchemy.dialects.postgresql import TSVECTOR, UUID
+from sqlalchemy.orm import deferred, relationship
 
 from core.database import Base
 
@@ -19,22 +29,45 @@ class AbstractModel(Base):
 class Menu(AbstractModel):
     __tablename__ = 'menus'
 
+    # maintained by the triggers below
+    submenus_count: int = Column(Integer, nullable=False, default=0, server_default='0')
+    dishes_count: int = Column(Integer, nullable=False, default=0, server_default='0')
     submenus = relationship('Submenu', cascade='all, delete')
 
 
 class Submenu(AbstractModel):
     __tablename__ = 'submenus'
+    __table_args__ = (
+        # index of the foreign key ordered as the pages of the submenu listing
+        Index('ix_submenus_menu_id_id', 'menu_id', 'id'),
+    )
 
     menu_id: UUID = Column(
         UUID(as_uuid=True),
         ForeignKey(Menu.id, onupdate='CASCADE', ondelete='CASCADE'),
         nullable=False,
     )
+    # maintained by the triggers below
+    dishes_count: int = Column(Integer, nullable=False, default=0, server_default='0')
     dishes = relationship('Dish', cascade='all, delete')
 
 
+# text search configuration of the dishes, it stems both Russian and English words
+SEARCH_CONFIG = 'russian'
+# titles rank above descriptions
+DISH_SEARCH_VECTOR = (
+    f"setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(title, '')), 'A') || "
+    f"setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(description, '')), 'B')"
+)
+
+
 class Dish(AbstractModel):
     __tablename__ = 'dishes'
+    __table_args__ = (
+        # index of the foreign key covering the dish listing, so its pages are served by an index-only scan
+        Index('ix_dishes_submenu_id_id', 'submenu_id', 'id', postgresql_include=['title', 'description', 'price']),
+        Index('ix_dishes_search_vector', 'search_vector', postgresql_using='gin'),
+    )
 
     price: Decimal = Column(Numeric(10, 2))
     submenu_id: UUID = Column(
@@ -42,3 +75,74 @@ class Dish(AbstractModel):
         ForeignKey(Submenu.id, onupdate='CASCADE', ondelete='CASCADE'),
         nullable=False,
     )
+    # kept by the database, only the search reads it
+    search_vector = deferred(Column(TSVECTOR, Computed(DISH_SEARCH_VECTOR, persisted=True)))
+
+
+# Statement level triggers keeping the counts of menus and submenus, one update of the parents per statement.
+# Dishes deleted by the cascade of a submenu are counted off the menu by the submenu trigger,
+# the submenu row is already gone when the dishes trigger runs.
+UPDATE_SUBMENUS_COUNT = '''
+CREATE OR REPLACE FUNCTION update_submenus_count() RETURNS trigger AS $$
+DECLARE
+    sign integer := CASE TG_OP WHEN 'INSERT' THEN 1 ELSE -1 END;
+BEGIN
+    UPDATE menus
+    SET submenus_count = menus.submenus_count + sign * changed.submenus_count,
+        dishes_count = menus.dishes_count + sign * changed.dishes_count
+    FROM (
+        SELECT menu_id, count(*) AS submenus_count, sum(dishes_count) AS dishes_count
+        FROM changed_rows
+        GROUP BY menu_id
+    ) AS changed
+    WHERE menus.id = changed.menu_id;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql
+'''
+UPDATE_DISHES_COUNT = '''
+CREATE OR REPLACE FUNCTION update_dishes_count() RETURNS trigger AS $$
+DECLARE
+    sign integer := CASE TG_OP WHEN 'INSERT' THEN 1 ELSE -1 END;
+BEGIN
+    UPDATE submenus
+    SET dishes_count = submenus.dishes_count + sign * changed.dishes_count
+    FROM (
+        SELECT submenu_id, count(*) AS dishes_count
+        FROM changed_rows
+        GROUP BY submenu_id
+    ) AS changed
+    WHERE submenus.id = changed.submenu_id;
+
+    UPDATE menus
+    SET dishes_count = menus.dishes_count + sign * changed.dishes_count
+    FROM (
+        SELECT submenus.menu_id, count(*) AS dishes_count
+        FROM changed_rows
+        JOIN submenus ON submenus.id = changed_rows.submenu_id
+        GROUP BY submenus.menu_id
+    ) AS changed
+    WHERE menus.id = changed.menu_id;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql
+'''
+COUNT_TRIGGER = '''
+CREATE TRIGGER {table}_count_{event}
+AFTER {event} ON {table}
+REFERENCING {transition} TABLE AS changed_rows
+FOR EACH STATEMENT EXECUTE FUNCTION update_{table}_count()
+'''
+COUNT_TRIGGERS = (
+    (Submenu.__table__, UPDATE_SUBMENUS_COUNT),
+    (Dish.__table__, UPDATE_DISHES_COUNT),
+)
+
+for table, function in COUNT_TRIGGERS:
+    event.listen(table, 'after_create', DDL(function))
+    for trigger_event, transition in (('INSERT', 'NEW'), ('DELETE', 'OLD')):
+        event.listen(
+            table,
+            'after_create',
+            DDL(COUNT_TRIGGER.format(table=table.name, event=trigger_event, transition=transition)),
+        )
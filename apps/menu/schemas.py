@@ -1,6 +1,9 @@
 import uuid
+from enum import Enum
 
-from pydantic import BaseModel, validator
+from pydantic import BaseModel, Field, validator
+
+from core.settings import BATCH_MAX_SIZE
 
 
 class BaseSchema(BaseModel):
@@ -53,3 +56,94 @@ class DishSchema(BaseSchema):
 
 class DishBaseSchema(BaseSchema):
     price: str
+
+
+class DishSearchSchema(DishSchema):
+    menu_id: uuid.UUID
+    submenu_id: uuid.UUID
+
+    @validator('menu_id', 'submenu_id')
+    def validate_parent_uuid(cls, value):
+        return str(value)
+
+
+class ItemUpdateSchema(BaseSchema):
+    id: uuid.UUID
+
+
+class DishUpdateSchema(DishBaseSchema):
+    id: uuid.UUID
+
+
+def validate_unique_ids(items: list) -> list:
+    if len({item.id for item in items}) != len(items):
+        raise ValueError('ids are not unique')
+    return items
+
+
+class BatchSchema(BaseModel):
+    create: list[BaseSchema] = Field([], max_items=BATCH_MAX_SIZE)
+    update: list[ItemUpdateSchema] = Field([], max_items=BATCH_MAX_SIZE)
+    delete: set[uuid.UUID] = Field(set(), max_items=BATCH_MAX_SIZE)
+
+    _unique_update_ids = validator('update', allow_reuse=True)(validate_unique_ids)
+
+
+# not a subclass of BatchSchema: lists are invariant, their items can't be narrowed by an override
+class DishBatchSchema(BaseModel):
+    create: list[DishBaseSchema] = Field([], max_items=BATCH_MAX_SIZE)
+    update: list[DishUpdateSchema] = Field([], max_items=BATCH_MAX_SIZE)
+    delete: set[uuid.UUID] = Field(set(), max_items=BATCH_MAX_SIZE)
+
+    _unique_update_ids = validator('update', allow_reuse=True)(validate_unique_ids)
+
+
+class BatchResultSchema(BaseModel):
+
+    class Config:
+        orm_mode = True
+
+
+class MenuBatchResultSchema(BatchResultSchema):
+    created: list[MenuSchema]
+    updated: list[MenuSchema]
+    deleted: list[uuid.UUID]
+
+
+class SubmenuBatchResultSchema(BatchResultSchema):
+    created: list[SubmenuSchema]
+    updated: list[SubmenuSchema]
+    deleted: list[uuid.UUID]
+
+
+class DishBatchResultSchema(BatchResultSchema):
+    created: list[DishSchema]
+    updated: list[DishSchema]
+    deleted: list[uuid.UUID]
+
+
+class SubmenuTreeSchema(SubmenuSchema):
+    dishes: list[DishSchema] = []
+
+
+class MenuTreeSchema(MenuSchema):
+    submenus: list[SubmenuTreeSchema] = []
+
+
+class ExportFormat(str, Enum):
+    xlsx = 'xlsx'
+    csv = 'csv'
+    ndjson = 'ndjson'
+
+
+class ExportStatus(str, Enum):
+    pending = 'pending'
+    running = 'running'
+    done = 'done'
+    failed = 'failed'
+
+
+class ExportStatusSchema(BaseModel):
+    file_id: str
+    status: ExportStatus
+    progress: int = 0
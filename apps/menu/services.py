@@ -1,14 +1,38 @@
-import traceback
+import re
+from decimal import Decimal
 from typing import Optional, Union
-from uuid import UUID
+from uuid import UUID, uuid4
 
-from fastapi import Depends
-from starlette.responses import FileResponse
+from fastapi import Depends, HTTPException
+from starlette.responses import FileResponse, JSONResponse, Response
+from starlette.status import HTTP_202_ACCEPTED, HTTP_404_NOT_FOUND
 
-from apps.menu.crud import DishCRUD, MenuCRUD, SubmenuCRUD
+from apps.menu import cache as rules
+from apps.menu.crud import BatchResult, DishCRUD, MenuCRUD, SubmenuCRUD
+from apps.menu.exporters import EXPORTERS, StreamingExporter
 from apps.menu.models import Dish, Menu, Submenu
-from apps.menu.schemas import BaseSchema
+from apps.menu.schemas import (
+    BaseSchema,
+    BatchSchema,
+    DishBatchSchema,
+    DishSchema,
+    DishSearchSchema,
+    ExportFormat,
+    ExportStatus,
+    ExportStatusSchema,
+    MenuSchema,
+    MenuTreeSchema,
+    SubmenuSchema,
+)
+from core.cache.cache import cached, make_key, make_tag
 from core.cache.redis import RedisCache
+from core.pagination import Page
+from core.settings import (
+    CACHE_SEARCH_HITS_WINDOW,
+    CACHE_SEARCH_MIN_HITS,
+    EXPORT_EXPIRATION,
+    EXPORT_STREAMING_MAX_ROWS,
+)
 
 
 class MenuService:
@@ -16,71 +40,85 @@ class MenuService:
     def __init__(self, repository: MenuCRUD = Depends(), cache: RedisCache = Depends()):
         self.repository = repository
         self.cache = cache
-        self.cache_for_invalidate = ['MenuService.get_all']
 
-    async def get_all(self) -> list[Menu]:
-        key = await self._get_cache_key()
-        cached_data = await self.cache.get(key)
-        if not cached_data:
-            db_data = await self.repository.get_all()
-            await self.cache.set(key, db_data)
+    async def get_all(self, page: Optional[Page] = None, title: Optional[str] = None) -> Union[Response, list[Menu]]:
+        # filtered lists are read from the database, see rules.MENU_LIST_KEY
+        if title is not None:
+            return await self.repository.get_all(page, title)
+        return await self._get_all(page)
 
-            return db_data
-        return cached_data
+    @cached(key=rules.MENU_LIST_KEY, tags=rules.MENU_LIST_TAGS, schema=list[MenuSchema])
+    async def _get_all(self, page: Optional[Page] = None) -> list[Menu]:
+        return await self.repository.get_all(page)
 
-    async def get_by_id(self, item_id: UUID) -> Menu:
-        key = await self._get_cache_key(item_id)
-        cached_data = await self.cache.get(key)
-        if not cached_data:
-            db_data = await self.repository.get_by_id(item_id)
-            await self.cache.set(key, db_data)
+    @cached(key=rules.MENU_KEY, tags=rules.MENU_TAGS, schema=MenuSchema)
+    async def get_by_id(self, menu_id: UUID) -> Menu:
+        return await self.repository.get_by_id(menu_id)
 
-            return db_data
-        return cached_data
+    @cached(key=rules.MENU_TREE_KEY, tags=rules.MENU_TREE_TAGS, schema=MenuTreeSchema)
+    async def get_tree(self, menu_id: UUID) -> Menu:
+        return await self.repository.get_tree(menu_id)
 
-    async def create(self, item_data: BaseSchema) -> Menu:
-        item = await self.repository.create(item_data)
-        await self.cache.bulk_delete(self.cache_for_invalidate)
-        return item
-
-    async def delete(self, item_id: UUID) -> Menu:
-        key = await self._get_cache_key(item_id)
-        item = await self.repository.delete(item_id)
-        await self._del_invalid_cache(key)
-        return item
-
-    async def update(self, item_id: UUID, item_data: BaseSchema) -> Menu:
-        key = await self._get_cache_key(item_id)
-        item = await self.repository.update(item_id, item_data)
-        await self._del_invalid_cache(key)
-
-        return item
+    @cached(key=rules.CATALOG_TREE_KEY, tags=rules.CATALOG_TREE_TAGS, schema=list[MenuTreeSchema])
+    async def get_trees(self) -> list[Menu]:
+        return await self.repository.get_trees()
 
-    async def _get_cache_key(self, item_id: Optional[UUID] = None) -> str:
-        class_name = self.__class__.__name__
-        if item_id is None:
-            func_name = traceback.extract_stack()[-2].name
-            return f'{class_name}.{func_name}'
-        key = f'{class_name}.{item_id}'
-        return key
+    @cached(invalidates=rules.MENU_CREATED)
+    async def create(self, item_data: BaseSchema) -> Menu:
+        return await self.repository.create(item_data)
 
-    async def _get_invalid_cache(self, key: Union[str, UUID]) -> list[Union[str, UUID]]:
-        invalid_cache = [*self.cache_for_invalidate, key]
+    @cached(invalidates=rules.MENU_DELETED)
+    async def delete(self, menu_id: UUID) -> Menu:
+        return await self.repository.delete(menu_id)
 
-        return invalid_cache
+    @cached(invalidates=rules.MENU_UPDATED)
+    async def update(self, menu_id: UUID, item_data: BaseSchema) -> Menu:
+        return await self.repository.update(menu_id, item_data)
 
-    async def _del_invalid_cache(self, key: str) -> None:
-        invalid_cache = await self._get_invalid_cache(key)
-        await self.cache.bulk_delete(invalid_cache)
+    @cached(invalidates=rules.MENU_BATCH)
+    async def batch(self, batch: BatchSchema) -> BatchResult:
+        return await self.repository.batch(batch)
 
+    @cached(invalidates=rules.MENU_CREATED)
     async def create_example(self, file_path: str) -> dict:
         return await self.repository.create_example(file_path)
 
-    async def generate_excel(self) -> dict:
-        return await self.repository.generate_excel()
-
-    async def get_excel(self, file_id: UUID) -> FileResponse:
-        return await self.repository.get_excel(file_id)
+    async def generate_export(self, export_format: ExportFormat) -> dict:
+        # one export per format and version of the catalog, repeated requests get the id of the same file
+        version = await self.cache.get_version(make_tag(rules.CATALOG, {}))
+        key = make_key(rules.EXPORT_KEY, {'export_format': export_format.value, 'version': version})
+        file_id = str(uuid4())
+        stored_file_id = await self.cache.add(key, file_id, ex=EXPORT_EXPIRATION)
+        if stored_file_id != file_id:
+            if (await self.repository.get_export_status(stored_file_id)).status != ExportStatus.failed:
+                return {'file_id': stored_file_id}
+            # failed export is built again
+            await self.cache.delete(key, as_task=False)
+            return await self.generate_export(export_format)
+        job_key = make_key(rules.EXPORT_JOB_KEY, {'file_id': file_id})
+        # recorded before the task starts, so that its status can be asked right away
+        await self.cache.add(job_key, file_id, ex=EXPORT_EXPIRATION)
+        try:
+            return await self.repository.generate_export(file_id, export_format)
+        except Exception:
+            await self.cache.bulk_delete([key, job_key], as_task=False)
+            raise
+
+    async def export(self, export_format: ExportFormat) -> Response:
+        """Streams small catalogs straight from the database, big ones are exported by the worker"""
+        exporter = EXPORTERS[export_format]
+        if isinstance(exporter, StreamingExporter) and await self.repository.count_dishes() <= EXPORT_STREAMING_MAX_ROWS:
+            return await self.repository.stream_export(export_format)
+        return JSONResponse(await self.generate_export(export_format), status_code=HTTP_202_ACCEPTED)
+
+    async def get_export(self, file_id: UUID) -> FileResponse:
+        return await self.repository.get_export(file_id)
+
+    async def get_export_status(self, file_id: UUID) -> ExportStatusSchema:
+        # Celery reports any unknown task as pending
+        if not await self.cache.exists(make_key(rules.EXPORT_JOB_KEY, {'file_id': file_id})):
+            raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail='file not found')
+        return await self.repository.get_export_status(str(file_id))
 
 
 class SubmenuService:
@@ -88,62 +126,39 @@ class SubmenuService:
     def __init__(self, repository: SubmenuCRUD = Depends(), cache: RedisCache = Depends()):
         self.repository: SubmenuCRUD = repository
         self.cache: RedisCache = cache
-        self.cache_for_invalidate = ('MenuService.get_all', )
-
-    async def get_all(self, menu_id: UUID) -> list[Submenu]:
-        key = await self._get_cache_key(menu_id)
-        cached_data = await self.cache.get(key)
-        if not cached_data:
-            db_data = await self.repository.get_all(menu_id)
-            await self.cache.set(key, db_data)
 
-            return db_data
-        return cached_data
+    async def get_all(
+            self,
+            menu_id: UUID,
+            page: Optional[Page] = None,
+            title: Optional[str] = None) -> Union[Response, list[Submenu]]:
+        if title is not None:
+            return await self.repository.get_all(menu_id, page, title)
+        return await self._get_all(menu_id, page)
 
-    async def get_by_id(self, item_id: UUID, menu_id: UUID) -> Submenu:
-        key = await self._get_cache_key(item_id)
-        cached_data = await self.cache.get(key)
-        if not cached_data:
-            db_data = await self.repository.get_by_id(item_id, menu_id)
-            await self.cache.set(key, db_data)
+    @cached(key=rules.SUBMENU_LIST_KEY, tags=rules.SUBMENU_LIST_TAGS, schema=list[SubmenuSchema])
+    async def _get_all(self, menu_id: UUID, page: Optional[Page] = None) -> list[Submenu]:
+        return await self.repository.get_all(menu_id, page)
 
-            return db_data
-        return cached_data
+    @cached(key=rules.SUBMENU_KEY, tags=rules.SUBMENU_TAGS, schema=SubmenuSchema)
+    async def get_by_id(self, submenu_id: UUID, menu_id: UUID) -> Submenu:
+        return await self.repository.get_by_id(submenu_id, menu_id)
 
+    @cached(invalidates=rules.SUBMENU_CREATED, counters=rules.SUBMENU_CREATED_COUNTERS)
     async def create(self, item_data: BaseSchema, menu_id: UUID) -> Submenu:
-        key = await self._get_cache_key(menu_id)
-        item = await self.repository.create(item_data, menu_id)
-        await self._del_invalid_cache(key, menu_id)
-        return item
+        return await self.repository.create(item_data, menu_id)
 
-    async def delete(self, item_id: UUID, menu_id: UUID) -> Submenu:
-        key = await self._get_cache_key(item_id)
-        item = await self.repository.delete(item_id, menu_id)
-        await self._del_invalid_cache(key, menu_id)
-        return item
+    @cached(invalidates=rules.SUBMENU_DELETED, counters=rules.SUBMENU_DELETED_COUNTERS)
+    async def delete(self, submenu_id: UUID, menu_id: UUID) -> Submenu:
+        return await self.repository.delete(submenu_id, menu_id)
 
-    async def update(self, item_id: UUID, item_data: BaseSchema, menu_id: UUID) -> Submenu:
-        key = await self._get_cache_key(item_id)
-        item = await self.repository.update(item_id, item_data, menu_id)
-        await self._del_invalid_cache(key, menu_id)
+    @cached(invalidates=rules.SUBMENU_UPDATED)
+    async def update(self, submenu_id: UUID, item_data: BaseSchema, menu_id: UUID) -> Submenu:
+        return await self.repository.update(submenu_id, item_data, menu_id)
 
-        return item
-
-    async def _get_cache_key(self, item_id: Optional[UUID] = None) -> str:
-        class_name = self.__class__.__name__
-        key = f'{class_name}.{item_id}'
-        return key
-
-    async def _get_invalid_cache(self, key: Union[str, UUID], menu_id: UUID) -> list[Union[str, UUID]]:
-        menu = f'{MenuService().__class__.__qualname__}.{menu_id}'
-        menu_submenus = await self._get_cache_key(menu_id)
-        invalid_cache = [menu, menu_submenus, key, *self.cache_for_invalidate]
-
-        return invalid_cache
-
-    async def _del_invalid_cache(self, key: str, menu_id: UUID) -> None:
-        invalid_cache = await self._get_invalid_cache(key, menu_id)
-        await self.cache.bulk_delete(invalid_cache)
+    @cached(invalidates=rules.SUBMENU_BATCH, counters=rules.SUBMENU_BATCH_COUNTERS)
+    async def batch(self, batch: BatchSchema, menu_id: UUID) -> BatchResult:
+        return await self.repository.batch(batch, menu_id)
 
 
 class DishService:
@@ -151,62 +166,53 @@ class DishService:
     def __init__(self, repository: DishCRUD = Depends(), cache: RedisCache = Depends()):
         self.repository: DishCRUD = repository
         self.cache: RedisCache = cache
-        self.cache_for_invalidate = ('MenuService.get_all',)
 
-    async def get_all(self, submenu_id: UUID) -> list[Dish]:
-        key = await self._get_cache_key(submenu_id)
-        cached_data = await self.cache.get(key)
-        if not cached_data:
-            db_data = await self.repository.get_all(submenu_id)
-            await self.cache.set(key, db_data)
-
-            return db_data
-        return cached_data
+    async def get_all(
+            self,
+            submenu_id: UUID,
+            menu_id: UUID,
+            page: Optional[Page] = None,
+            title: Optional[str] = None,
+            min_price: Optional[Decimal] = None,
+            max_price: Optional[Decimal] = None) -> Union[Response, list[Dish]]:
+        if title is not None or min_price is not None or max_price is not None:
+            return await self.repository.get_all(submenu_id, page, title, min_price, max_price)
+        return await self._get_all(submenu_id, menu_id, page)
+
+    @cached(key=rules.DISH_LIST_KEY, tags=rules.DISH_LIST_TAGS, schema=list[DishSchema])
+    async def _get_all(self, submenu_id: UUID, menu_id: UUID, page: Optional[Page] = None) -> list[Dish]:
+        return await self.repository.get_all(submenu_id, page)
+
+    async def search(self, q: str, page: Page) -> Union[Response, list]:
+        # queries differing only in case and punctuation share the cache entry
+        terms = ' '.join(re.findall(r'[^\W_]+', q.lower()))
+        if not terms:
+            return []
+        hits_key = make_key(rules.DISH_SEARCH_HITS_KEY, {'terms': terms})
+        if await self.cache.incr(hits_key, ex=CACHE_SEARCH_HITS_WINDOW) < CACHE_SEARCH_MIN_HITS:
+            return await self.repository.search(terms, page)
+        return await self._search(terms, page)
+
+    @cached(key=rules.DISH_SEARCH_KEY, tags=rules.DISH_SEARCH_TAGS, schema=list[DishSearchSchema])
+    async def _search(self, terms: str, page: Page) -> list:
+        return await self.repository.search(terms, page)
+
+    @cached(key=rules.DISH_KEY, tags=rules.DISH_TAGS, schema=DishSchema)
+    async def get_by_id(self, dish_id: UUID, submenu_id: UUID, menu_id: UUID) -> Dish:
+        return await self.repository.get_by_id(dish_id, submenu_id)
+
+    @cached(invalidates=rules.DISH_CREATED, counters=rules.DISH_CREATED_COUNTERS)
+    async def create(self, item_data: BaseSchema, submenu_id: UUID, menu_id: UUID) -> Dish:
+        return await self.repository.create(item_data, submenu_id, menu_id)
 
-    async def get_by_id(self, item_id: UUID, submenu_id: UUID) -> Dish:
-        key = await self._get_cache_key(item_id)
-        cached_data = await self.cache.get(key)
-        if not cached_data:
-            db_data = await self.repository.get_by_id(item_id, submenu_id)
-            await self.cache.set(key, db_data)
+    @cached(invalidates=rules.DISH_DELETED, counters=rules.DISH_DELETED_COUNTERS)
+    async def delete(self, dish_id: UUID, submenu_id: UUID, menu_id: UUID) -> Dish:
+        return await self.repository.delete(dish_id, submenu_id, menu_id)
 
-            return db_data
-        return cached_data
+    @cached(invalidates=rules.DISH_UPDATED)
+    async def update(self, dish_id: UUID, item_data: BaseSchema, submenu_id: UUID, menu_id: UUID) -> Dish:
+        return await self.repository.update(dish_id, item_data, submenu_id)
 
-    async def create(self, item_data: BaseSchema, submenu_id: UUID, menu_id: UUID) -> Dish:
-        key = await self._get_cache_key()
-        item = await self.repository.create(item_data, submenu_id, menu_id)
-        await self._del_invalid_cache(key, submenu_id, menu_id)
-        return item
-
-    async def delete(self, item_id: UUID, submenu_id: UUID, menu_id: UUID) -> Dish:
-        key = await self._get_cache_key(item_id)
-        item = await self.repository.delete(item_id, submenu_id, menu_id)
-        await self._del_invalid_cache(key, submenu_id, menu_id)
-
-        return item
-
-    async def update(self, item_id: UUID, item_data: BaseSchema, submenu_id: UUID, menu_id: UUID) -> Dish:
-        key = await self._get_cache_key(item_id)
-        item = await self.repository.update(item_id, item_data, submenu_id)
-        await self._del_invalid_cache(key, submenu_id, menu_id)
-
-        return item
-
-    async def _get_cache_key(self, item_id: Optional[UUID] = None) -> str:
-        class_name = self.__class__.__name__
-        key = f'{class_name}.{item_id}'
-        return key
-
-    async def _get_invalid_cache(self, key: Union[str, UUID], submenu_id: UUID, menu_id: UUID) -> list[Union[str, UUID]]:
-        menu = f'{MenuService().__class__.__name__}.{menu_id}'
-        submenu = f'{SubmenuService().__class__.__name__}.{submenu_id}'
-        submenu_dishes = await self._get_cache_key(submenu_id)
-        invalid_cache = [menu, submenu, submenu_dishes,
-                         key, *self.cache_for_invalidate]
-
-        return invalid_cache
-
-    async def _del_invalid_cache(self, key: str, submenu_id: UUID, menu_id: UUID) -> None:
-        invalid_cache = await self._get_invalid_cache(key, submenu_id, menu_id)
-        await self.cache.bulk_delete(invalid_cache)
+    @cached(invalidates=rules.DISH_BATCH, counters=rules.DISH_BATCH_COUNTERS)
+    async def batch(self, batch: DishBatchSchema, submenu_id: UUID, menu_id: UUID) -> BatchResult:
+        return await self.repository.batch(batch, submenu_id)
@@ -1,32 +1,57 @@
+import asyncio
 import os.path
-import pickle
+import time
+from typing import Callable, Optional
 
 from celery import shared_task
-from openpyxl import Workbook
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.pool import NullPool
 
-from core.settings import GENERATED_FILES_DIRNAME
+from core.database import create_engine
+from core.settings import DATABASE_URL, EXPORT_EXPIRATION, GENERATED_FILES_DIRNAME
+
+from .exporters import EXPORTERS, Exporter, catalog_rows
+from .schemas import ExportFormat
+
+# state of the running export, its meta holds the percentage of the menus written
+PROGRESS = 'PROGRESS'
 
 
 @shared_task(bind=True)
-def gen_excel_task(self, data):
-    full_menus_data = pickle.loads(data)
-    workbook = Workbook()
-    worksheet = workbook.active
-    empty_cell = ''
-    column_dimensions = {'A': 5, 'B': 12, 'C': 25, 'D': 30, 'E': 70, 'F': 10}
-
-    for col, value in column_dimensions.items():
-        worksheet.column_dimensions[col].width = value
-
-    for m_num, menu in enumerate(full_menus_data, start=1):
-        worksheet.append([m_num, menu.title, menu.description])
-        for s_num, submenu in enumerate(menu.submenus, start=1):
-            worksheet.append(
-                [empty_cell, s_num, submenu.title, submenu.description])
-            for d_num, dish in enumerate(submenu.dishes, start=1):
-                worksheet.append(
-                    [empty_cell, empty_cell, d_num, dish.title, dish.description, dish.price])
+def gen_export_task(self, export_format: str = ExportFormat.xlsx.value):
     if not os.path.exists(GENERATED_FILES_DIRNAME):
         os.mkdir(GENERATED_FILES_DIRNAME)
-    file_path = os.path.join(GENERATED_FILES_DIRNAME, self.request.id)
-    workbook.save(f'{file_path}.xlsx')
+    exporter = EXPORTERS[ExportFormat(export_format)]
+    file_path = os.path.join(GENERATED_FILES_DIRNAME, f'{self.request.id}.{exporter.extension}')
+
+    def report_progress(progress: int) -> None:
+        self.update_state(state=PROGRESS, meta={'progress': progress})
+
+    asyncio.run(write_export(exporter, file_path, on_progress=report_progress))
+    remove_expired_exports()
+
+
+def remove_expired_exports() -> None:
+    """Removes exports nobody is given an id of anymore"""
+    expired = time.time() - EXPORT_EXPIRATION
+    with os.scandir(GENERATED_FILES_DIRNAME) as entries:
+        for entry in entries:
+            if entry.is_file() and entry.stat().st_mtime < expired:
+                os.remove(entry.path)
+
+
+async def write_export(
+        exporter: Exporter,
+        file_path: str,
+        database_url: Optional[str] = DATABASE_URL,
+        on_progress: Optional[Callable[[int], None]] = None) -> None:
+    """Writes the menus with their submenus and dishes batch by batch,
+    memory used doesn't depend on the size of the catalog"""
+    # the worker runs every task in a new event loop, connections can't outlive it.
+    # Menus are counted and read from the same snapshot
+    engine = create_engine(database_url, poolclass=NullPool, isolation_level='REPEATABLE READ')
+    try:
+        async with AsyncSession(engine) as session:
+            await exporter.save(catalog_rows(session, on_progress), file_path)
+    finally:
+        await engine.dispose()
@@ -0,0 +1,61 @@
+from fastapi import APIRouter, Depends
+from sqlalchemy.ext.asyncio import AsyncEngine
+from starlette.status import HTTP_200_OK
+
+from apps.auth.crud import token_cache
+from apps.monitoring.schemas import (
+    CacheMetricsSchema,
+    DatabaseMetricsSchema,
+    TokenCacheMetricsSchema,
+)
+from core.cache.redis import RedisCache
+from core.database import engine, replica_engines
+
+router = APIRouter(prefix='/metrics', tags=['metrics'])
+
+
+def pool_metrics(label: str, database_engine: AsyncEngine) -> dict:
+    # the endpoint is public, the pools are named by their role, not by the address of the database
+    return {'database': label, **database_engine.sync_engine.pool.metrics()}
+
+
+@router.get('/cache', response_model=CacheMetricsSchema, status_code=HTTP_200_OK, summary='Статистика кэша')
+async def get_cache_metrics(cache: RedisCache = Depends()):
+    """Возвращает количество попаданий, промахов и вытеснений для каждого уровня кэша"""
+    return await cache.stats()
+
+
+@router.get(
+    '/tokens',
+    response_model=TokenCacheMetricsSchema,
+    status_code=HTTP_200_OK,
+    summary='Статистика кэша токенов',
+)
+async def get_token_cache_metrics():
+    """Возвращает количество попаданий, промахов и долю попаданий кэша проверенных токенов этого процесса"""
+    stats = token_cache.stats
+    lookups = stats.hits + stats.misses
+    return {
+        **stats.dict(),
+        'entries': len(token_cache),
+        'bytes': token_cache.size,
+        'hit_ratio': stats.hits / lookups if lookups else 0,
+    }
+
+
+@router.get(
+    '/database',
+    response_model=DatabaseMetricsSchema,
+    status_code=HTTP_200_OK,
+    summary='Статистика пулов соединений',
+)
+async def get_database_pool_metrics():
+    """Возвращает для основной базы и для каждой реплики размер пула соединений этого процесса,
+    число занятых соединений, ожидающих соединения запросов, а также суммарное и максимальное
+    время ожидания в секундах"""
+    return {
+        'primary': pool_metrics('primary', engine),
+        'replicas': [
+            pool_metrics(f'replica-{number}', replica_engine) for number, replica_engine in enumerate(replica_engines)
+        ],
+    }
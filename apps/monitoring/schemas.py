@@ -0,0 +1,40 @@
+from pydantic import BaseModel
+
+
+class CacheTierSchema(BaseModel):
+    hits: int
+    misses: int
+    evictions: int
+
+
+class LocalCacheTierSchema(CacheTierSchema):
+    entries: int
+    bytes: int
+
+
+class CacheMetricsSchema(BaseModel):
+    local: LocalCacheTierSchema
+    redis: CacheTierSchema
+
+
+class TokenCacheMetricsSchema(LocalCacheTierSchema):
+    hit_ratio: float
+
+
+class DatabasePoolMetricsSchema(BaseModel):
+    # role of the database: primary, replica-0, replica-1...
+    database: str
+    size: int
+    checked_out: int
+    checked_in: int
+    overflow: int
+    waiters: int
+    acquisitions: int
+    timeouts: int
+    wait_time: float
+    max_wait_time: float
+
+
+class DatabaseMetricsSchema(BaseModel):
+    primary: DatabasePoolMetricsSchema
+    replicas: list[DatabasePoolMetricsSchema]
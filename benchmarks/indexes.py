@@ -0,0 +1,103 @@
+"""Compares query plans of the menu reads and of the cascade delete with and without the foreign key indexes.
+
+Seeds 100 menus x 10 submenus x 100 dishes into the `benchmark` schema of the database
+(DATABASE_URL by default) and drops the schema afterwards:
+
+    python -m benchmarks.indexes [database url]
+"""
+import asyncio
+import re
+import sys
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from apps.menu import models
+from core.settings import DATABASE_URL
+
+SCHEMA = 'benchmark'
+MENUS, SUBMENUS, DISHES = 100, 10, 100
+
+SEED = (
+    f'''
+    INSERT INTO menus (id, title, description)
+    SELECT gen_random_uuid(), 'menu ' || i, 'description' FROM generate_series(1, {MENUS}) AS i
+    ''',
+    f'''
+    INSERT INTO submenus (id, title, description, menu_id)
+    SELECT gen_random_uuid(), 'submenu ' || i, 'description', menus.id
+    FROM menus, generate_series(1, {SUBMENUS}) AS i
+    ''',
+    f'''
+    INSERT INTO dishes (id, title, description, price, submenu_id)
+    SELECT gen_random_uuid(), 'dish ' || i, 'description', i, submenus.id
+    FROM submenus, generate_series(1, {DISHES}) AS i
+    ''',
+)
+QUERIES = {
+    'submenu list': 'SELECT * FROM submenus WHERE menu_id = :menu_id',
+    'dish list': 'SELECT id, title, description, price, submenu_id FROM dishes WHERE submenu_id = :submenu_id',
+    'dish page': 'SELECT id, title, description, price, submenu_id FROM dishes WHERE submenu_id = :submenu_id '
+                 'ORDER BY id LIMIT 100',
+    'menu delete': 'DELETE FROM menus WHERE id = :menu_id',
+}
+INDEXES = ('ix_submenus_menu_id_id', 'ix_dishes_submenu_id_id')
+
+
+async def explain(engine, arguments: dict) -> dict:
+    timings = {}
+    for name, query in QUERIES.items():
+        # the plans are rolled back, deleted menu is kept for the next run
+        async with engine.connect() as connection:
+            plan = (await connection.execute(text(f'EXPLAIN ANALYZE {query}'), arguments)).scalars().all()
+        # execution time includes the triggers of the foreign keys deleting the children
+        match = re.search(r'Execution Time: ([\d.]+)', plan[-1])
+        if match is None:
+            raise RuntimeError(f'No execution time in the plan of {name}: {plan[-1]}')
+        execution_time = float(match.group(1))
+        timings[name] = (execution_time, plan[0].strip())
+    return timings
+
+
+async def main(url: str) -> None:
+    engine = create_async_engine(url, connect_args={'server_settings': {'search_path': SCHEMA}})
+    # VACUUM can't run inside a transaction
+    async with engine.connect() as connection:
+        connection = await connection.execution_options(isolation_level='AUTOCOMMIT')
+        await connection.execute(text(f'DROP SCHEMA IF EXISTS {SCHEMA} CASCADE'))
+        await connection.execute(text(f'CREATE SCHEMA {SCHEMA}'))
+        try:
+            await connection.run_sync(models.Base.metadata.create_all)
+            for query in SEED:
+                await connection.execute(text(query))
+            arguments = dict(
+                (await connection.execute(text('SELECT menu_id, id AS submenu_id FROM submenus LIMIT 1'))).one()._mapping
+            )
+
+            for index in INDEXES:
+                await connection.execute(text(f'DROP INDEX {index}'))
+            await connection.execute(text('VACUUM ANALYZE'))
+            before = await explain(engine, arguments)
+
+            await connection.execute(text('CREATE INDEX ix_submenus_menu_id_id ON submenus (menu_id, id)'))
+            await connection.execute(
+                text('CREATE INDEX ix_dishes_submenu_id_id ON dishes (submenu_id, id) INCLUDE (title, description, price)')
+            )
+            await connection.execute(text('VACUUM ANALYZE'))
+            after = await explain(engine, arguments)
+        finally:
+            await connection.execute(text(f'DROP SCHEMA {SCHEMA} CASCADE'))
+    await engine.dispose()
+
+    print(f'{MENUS * SUBMENUS * DISHES} dishes')
+    for name in QUERIES:
+        print(f'{name}:')
+        print(f'  without indexes {before[name][0]:9.3f} ms  {before[name][1]}')
+        print(f'  with indexes    {after[name][0]:9.3f} ms  {after[name][1]}')
+
+
+if __name__ == '__main__':
+    database_url = sys.argv[1] if len(sys.argv) > 1 else DATABASE_URL
+    if database_url is None:
+        sys.exit('usage: python -m benchmarks.indexes [database url], DATABASE_URL is used by default')
+    asyncio.run(main(database_url))
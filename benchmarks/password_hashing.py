@@ -0,0 +1,102 @@
+"""Measures the latency of menu reads while a burst of sign ins verifies passwords.
+
+Compares bcrypt called right in the coroutine, which blocks the event loop, with the thread pool
+the sign in uses. The reads go through the application and are served from the cache after the
+first one, so their latency is the time the event loop takes to get to them. One menu is created
+in the `benchmark` schema of the database (DATABASE_URL by default), the schema is dropped afterwards:
+
+    python -m benchmarks.password_hashing [database url]
+"""
+import asyncio
+import statistics
+import sys
+import time
+from typing import Awaitable, Optional
+
+from httpx import AsyncClient
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from apps.auth.crud import UserCRUD, password_hasher
+from apps.menu import models
+from core.cache.redis import close_cache_client, create_cache_client, get_cache_client
+from core.database import get_session
+from core.settings import DATABASE_URL, PASSWORD_HASH_CONCURRENCY, PASSWORD_HASH_ROUNDS
+from main import fastapi_app
+
+SCHEMA = 'benchmark'
+SIGN_INS = 20
+PASSWORD = 'password'
+
+
+async def blocking_verify(plain_password: str, hashed_password: str) -> bool:
+    # the implementation before the thread pool
+    return password_hasher.verify(plain_password, hashed_password)
+
+
+async def read_latencies(client: AsyncClient, burst: Optional[Awaitable] = None) -> list[float]:
+    """Reads the menus one after another until the burst is over, or for a second without a burst"""
+    task = asyncio.ensure_future(burst if burst is not None else asyncio.sleep(1))
+    latencies = []
+    while not task.done():
+        started = time.perf_counter()
+        response = await client.get('/api/v1/menus/')
+        response.raise_for_status()
+        latencies.append((time.perf_counter() - started) * 1000)
+    await task
+    return latencies
+
+
+def summary(latencies: list[float]) -> str:
+    quantiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+    return (
+        f'{len(latencies):6} reads  p50 {quantiles[49]:8.2f} ms  p99 {quantiles[98]:8.2f} ms  '
+        f'max {max(latencies):8.2f} ms'
+    )
+
+
+async def main(url: str) -> None:
+    engine = create_async_engine(url, connect_args={'server_settings': {'search_path': SCHEMA}})
+    session_factory = sessionmaker(engine, class_=AsyncSession)
+
+    async def get_benchmark_session() -> AsyncSession:
+        async with session_factory() as session:
+            yield session
+
+    async with engine.begin() as connection:
+        await connection.execute(text(f'DROP SCHEMA IF EXISTS {SCHEMA} CASCADE'))
+        await connection.execute(text(f'CREATE SCHEMA {SCHEMA}'))
+        await connection.run_sync(models.Base.metadata.create_all)
+        await connection.execute(text("INSERT INTO menus (id, title, description) VALUES (gen_random_uuid(), 'menu', '')"))
+
+    cache_client = create_cache_client()
+    fastapi_app.dependency_overrides[get_session] = get_benchmark_session
+    fastapi_app.dependency_overrides[get_cache_client] = lambda: cache_client
+    password_hash = password_hasher.hash(PASSWORD)
+    try:
+        async with AsyncClient(app=fastapi_app, base_url='http://benchmark') as client:
+            await client.get('/api/v1/menus/')
+            idle = await read_latencies(client)
+            blocking = await read_latencies(
+                client, asyncio.gather(*(blocking_verify(PASSWORD, password_hash) for _ in range(SIGN_INS))))
+            pooled = await read_latencies(
+                client, asyncio.gather(*(UserCRUD._verify_password(PASSWORD, password_hash) for _ in range(SIGN_INS))))
+    finally:
+        fastapi_app.dependency_overrides = {}
+        await close_cache_client(cache_client)
+        async with engine.begin() as connection:
+            await connection.execute(text(f'DROP SCHEMA {SCHEMA} CASCADE'))
+        await engine.dispose()
+
+    print(f'{SIGN_INS} sign ins, bcrypt rounds {PASSWORD_HASH_ROUNDS}, {PASSWORD_HASH_CONCURRENCY} threads')
+    print(f'  no sign ins        {summary(idle)}')
+    print(f'  blocking bcrypt    {summary(blocking)}')
+    print(f'  bcrypt in threads  {summary(pooled)}')
+
+
+if __name__ == '__main__':
+    database_url = sys.argv[1] if len(sys.argv) > 1 else DATABASE_URL
+    if database_url is None:
+        sys.exit('usage: python -m benchmarks.password_hashing [database url], DATABASE_URL is used by default')
+    asyncio.run(main(database_url))
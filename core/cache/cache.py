@@ -1,45 +1,132 @@
-# import pickle
-# from typing import Callable, Generator
-# from uuid import UUID
-#
-# from core.cache.redis import cache_client
-# from core.settings import CACHE_EXPIRATION
-#
-#
-# def _get_uuid(*args, **kwargs) -> Generator:
-#     params = list(args)
-#     params.extend(kwargs.values())
-#     for i in params:
-#         if isinstance(i, UUID):
-#             yield str(i)
-#
-#
-# async def _delete_cache(items_uuid: Generator):
-#     keys_to_delete = ['MenuCRUD.get_all',
-#                       'SubmenuCRUD.get_all', 'DishCRUD.get_all']
-#     uuids_to_delete = list(items_uuid)
-#     keys_to_delete.extend(uuids_to_delete)
-#     await cache_client.delete(*keys_to_delete)
-#
-#
-# def cache(function: Callable):
-#     async def wrapper(self, *args, **kwargs):
-#         items_uuid = _get_uuid(*args, **kwargs)
-#         if function.__name__ in ('create', 'create_example', 'update', 'delete'):
-#             db_data = await function(self, *args, **kwargs)
-#             await _delete_cache(items_uuid)
-#
-#             return db_data
-#
-#         redis_key = function.__qualname__ if function.__name__ == 'get_all' else next(
-#             items_uuid)
-#
-#         cached_data = await cache_client.get(redis_key)
-#         if not cached_data:
-#             db_data = await function(self, *args, **kwargs)
-#             await cache_client.set(redis_key, pickle.dumps(db_data), ex=CACHE_EXPIRATION)
-#
-#             return db_data
-#         return pickle.loads(cached_data)
-#
-#     return wrapper
+import functools
+import inspect
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Iterable,
+    Optional,
+    TypeVar,
+    Union,
+    overload,
+)
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+from pydantic import parse_obj_as
+from starlette.responses import Response
+from typing_extensions import ParamSpec
+
+from core.settings import CACHE_CONTROL, CACHE_NAMESPACE, CACHE_VERSION
+
+F = TypeVar('F', bound=Callable[..., Awaitable[Any]])
+P = ParamSpec('P')
+# (tag, item id, counter name, change), change can be computed from the result of the method
+Counter = tuple[str, str, str, Union[int, Callable[[Any], int]]]
+# tag template, or tag templates computed from the result of the method
+Invalidation = Union[str, Callable[[Any], Iterable[str]]]
+
+
+def make_key(template: str, arguments: dict) -> str:
+    return f'{CACHE_NAMESPACE}:v{CACHE_VERSION}:{template.format(**arguments)}'
+
+
+def make_tag(template: str, arguments: dict) -> str:
+    return make_key(f'tag:{template}', arguments)
+
+
+async def dump_json(schema: Any, func: Callable[..., Awaitable], *args, **kwargs) -> bytes:
+    """Calls func and serializes its result validated against the schema, as FastAPI would serialize the response"""
+    value = await func(*args, **kwargs)
+    if schema is not None:
+        value = parse_obj_as(schema, value)
+    return orjson.dumps(jsonable_encoder(value))
+
+
+@overload
+def cached(
+        key: str,
+        tags: Iterable[str] = (),
+        invalidates: Iterable[Invalidation] = (),
+        counters: Iterable[Counter] = (),
+        schema: Any = None) -> Callable[[Callable[P, Awaitable[Any]]], Callable[P, Awaitable[Response]]]:
+    ...
+
+
+@overload
+def cached(
+        key: None = None,
+        tags: Iterable[str] = (),
+        invalidates: Iterable[Invalidation] = (),
+        counters: Iterable[Counter] = (),
+        schema: Any = None) -> Callable[[F], F]:
+    ...
+
+
+def cached(
+        key: Optional[str] = None,
+        tags: Iterable[str] = (),
+        invalidates: Iterable[Invalidation] = (),
+        counters: Iterable[Counter] = (),
+        schema: Any = None) -> Callable[[F], Callable[..., Awaitable[Any]]]:
+    """Caches the result of a service method under `key` tagged with `tags`,
+    or invalidates entries tagged with `invalidates` after the method has been called
+    and changes `counters` of the items in the entries that are kept.
+    Keys, tags and item ids are str.format templates filled with the method arguments, e.g. 'menus:{menu_id}'.
+    Invalidated tags can also be computed from the result, e.g. a tag per item changed by a batch.
+    Results are cached serialized with the response `schema` and returned as a ready JSON response,
+    a hit doesn't decode nor validate anything: a decorated read returns a Response, whatever the method returns.
+    The response carries the ETag of the entry, so that conditional requests can be answered with 304
+    (see ConditionalGetMiddleware).
+    The service must keep its RedisCache in the `cache` attribute"""
+    tags = tuple(tags)
+    invalidates = tuple(invalidates)
+    counters = tuple(counters)
+
+    def decorator(method: F) -> Callable[..., Awaitable[Any]]:
+        signature = inspect.signature(method)
+
+        @functools.wraps(method)
+        async def wrapper(self, *args, **kwargs):
+            bound_arguments = signature.bind(self, *args, **kwargs)
+            bound_arguments.apply_defaults()
+            arguments = bound_arguments.arguments
+
+            if key is not None:
+                entry = await self.cache.get_or_set(
+                    make_key(key, arguments),
+                    functools.partial(dump_json, schema, method, self, *args, **kwargs),
+                    tags=[make_tag(template, arguments) for template in tags],
+                )
+                return Response(
+                    entry.value,
+                    media_type='application/json',
+                    headers={'ETag': entry.etag, 'Cache-Control': CACHE_CONTROL},
+                )
+
+            # entries of the other tags are changed by the invalidation itself, only the entries
+            # whose counters are changed in place have to be told from the ones computed during the write
+            write_versions = await self.cache.begin_write({make_tag(tag, arguments) for tag, *_ in counters})
+            result = await method(self, *args, **kwargs)
+            await self.cache.invalidate(
+                [
+                    make_tag(template, arguments)
+                    for invalidation in invalidates
+                    for template in (invalidation(result) if callable(invalidation) else (invalidation,))
+                ],
+                counters=[
+                    (
+                        make_tag(tag, arguments),
+                        item_id.format(**arguments),
+                        counter,
+                        change(result) if callable(change) else change,
+                    )
+                    for tag, item_id, counter, change in counters
+                ],
+                write_versions=write_versions,
+            )
+            return result
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,56 @@
+from typing import Optional
+
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# headers a 304 response has to repeat, anything about the body is dropped
+NOT_MODIFIED_HEADERS = (b'cache-control', b'content-location', b'date', b'etag', b'expires', b'vary')
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison of If-None-Match with the ETag of the response, a missing header matches nothing"""
+    if if_none_match is None:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    return etag.removeprefix('W/') in (tag.strip().removeprefix('W/') for tag in if_none_match.split(','))
+
+
+class ConditionalGetMiddleware:
+    """Answers 304 Not Modified to GET and HEAD requests whose If-None-Match matches the ETag of the response.
+    Cached reads carry the ETag of the cache entry, so a hit is answered without the database and the body"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http' or scope['method'] not in ('GET', 'HEAD'):
+            await self.app(scope, receive, send)
+            return
+        if_none_match = Headers(scope=scope).get('if-none-match')
+        if if_none_match is None:
+            await self.app(scope, receive, send)
+            return
+
+        not_modified = False
+
+        async def send_conditional(message: Message) -> None:
+            nonlocal not_modified
+            if message['type'] == 'http.response.start':
+                etag = Headers(raw=message['headers']).get('etag')
+                if message['status'] == 200 and etag is not None and etag_matches(if_none_match, etag):
+                    not_modified = True
+                    await send({
+                        'type': 'http.response.start',
+                        'status': 304,
+                        'headers': [(name, value) for name, value in message['headers']
+                                    if name.lower() in NOT_MODIFIED_HEADERS],
+                    })
+                    return
+            elif message['type'] == 'http.response.body' and not_modified:
+                if not message.get('more_body', False):
+                    await send({'type': 'http.response.body', 'body': b''})
+                return
+            await send(message)
+
+        await self.app(scope, receive, send_conditional)
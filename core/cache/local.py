@@ -0,0 +1,99 @@
+import time
+from collections import OrderedDict
+from typing import Any, Iterable, Optional
+
+from core.settings import (
+    CACHE_LOCAL_EXPIRATION,
+    CACHE_LOCAL_MAX_BYTES,
+    CACHE_LOCAL_MAX_ENTRIES,
+)
+
+
+class CacheStats:
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def dict(self) -> dict:
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+
+class LocalCache:
+    """In-process LRU cache with per-key TTL, bounded by entries count and total size.
+    Entries can be tagged and invalidated by tag"""
+
+    def __init__(
+            self,
+            max_entries: int = CACHE_LOCAL_MAX_ENTRIES,
+            max_bytes: int = CACHE_LOCAL_MAX_BYTES,
+            ex: int = CACHE_LOCAL_EXPIRATION):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ex = ex
+        self.size = 0
+        self.stats = CacheStats()
+        self._entries: OrderedDict[str, tuple[Any, int, float, tuple]] = OrderedDict()
+        self._tags: dict[str, set[str]] = {}
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.stats.misses += 1
+            return None
+        value, _, expires_at, _ = entry
+        if expires_at <= time.monotonic():
+            self._pop(key)
+            self.stats.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.stats.hits += 1
+        return value
+
+    def set(self, key: str, value: Any, size: int, ex: Optional[int] = None, tags: Iterable[str] = ()) -> None:
+        self._pop(key)
+        if size > self.max_bytes:
+            return
+        ex = self.ex if ex is None else min(ex, self.ex)
+        tags = tuple(tags)
+        self._entries[key] = (value, size, time.monotonic() + ex, tags)
+        self.size += size
+        for tag in tags:
+            self._tags.setdefault(tag, set()).add(key)
+        while len(self._entries) > self.max_entries or self.size > self.max_bytes:
+            self._pop(next(iter(self._entries)))
+            self.stats.evictions += 1
+
+    def delete(self, *keys: str) -> None:
+        for key in keys:
+            self._pop(key)
+
+    def invalidate(self, *tags: str) -> None:
+        for tag in tags:
+            for key in self._tags.pop(tag, set()):
+                self._pop(key)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._tags.clear()
+        self.size = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _pop(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        _, size, _, tags = entry
+        self.size -= size
+        for tag in tags:
+            tagged_keys = self._tags.get(tag)
+            if tagged_keys is not None:
+                tagged_keys.discard(key)
+                if not tagged_keys:
+                    del self._tags[tag]
+
+
+local_cache = LocalCache()
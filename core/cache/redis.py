@@ -1,21 +1,111 @@
+import asyncio
+import hashlib
 import json
-from typing import Any, Union
+import logging
+import math
+import random
+import time
+from typing import Awaitable, Callable, Iterable, NamedTuple, Optional, Union
 from uuid import UUID
 
-from fastapi import Depends
-from fastapi.encoders import jsonable_encoder
+from fastapi import Depends, Request
 from redis.asyncio.client import Redis  # type: ignore
-from redis.asyncio.connection import ConnectionPool  # type: ignore
+from redis.asyncio.connection import BlockingConnectionPool  # type: ignore
+from redis.exceptions import LockError, RedisError, ResponseError  # type: ignore
 from starlette.background import BackgroundTasks
 
-from core.settings import CACHE_EXPIRATION, CACHE_URL
+from core.cache.local import CacheStats, local_cache
+from core.cache.scripts import begin_write, get_versions, invalidate_tags, store_entry
+from core.cache.single_flight import single_flight
+from core.database import reading_replica
+from core.settings import (
+    CACHE_EXPIRATION,
+    CACHE_HEALTH_CHECK_INTERVAL,
+    CACHE_INVALIDATION_CHANNEL,
+    CACHE_LOCK_ENABLED,
+    CACHE_LOCK_POLL_INTERVAL,
+    CACHE_LOCK_TIMEOUT,
+    CACHE_POOL_MAX_CONNECTIONS,
+    CACHE_POOL_TIMEOUT,
+    CACHE_SOCKET_CONNECT_TIMEOUT,
+    CACHE_SOCKET_TIMEOUT,
+    CACHE_SOFT_EXPIRATION,
+    CACHE_URL,
+    CACHE_XFETCH_BETA,
+    DATABASE_STICKY_SECONDS,
+)
 
+logger = logging.getLogger(__name__)
 
-async def get_cache_client() -> Redis:
-    connection_pool = ConnectionPool.from_url(url=CACHE_URL)
-    async_cache_client = Redis(connection_pool=connection_pool)
-    async with async_cache_client as cache_client:
-        yield cache_client
+
+def create_cache_client(url: Optional[str] = CACHE_URL) -> Redis:
+    # one pool per process: created at application startup, closed at shutdown
+    connection_pool = BlockingConnectionPool.from_url(
+        url=url,
+        max_connections=CACHE_POOL_MAX_CONNECTIONS,
+        timeout=CACHE_POOL_TIMEOUT,
+        health_check_interval=CACHE_HEALTH_CHECK_INTERVAL,
+        socket_timeout=CACHE_SOCKET_TIMEOUT,
+        socket_connect_timeout=CACHE_SOCKET_CONNECT_TIMEOUT,
+    )
+    return Redis(connection_pool=connection_pool)
+
+
+async def close_cache_client(cache_client: Redis) -> None:
+    await cache_client.close()
+    await cache_client.connection_pool.disconnect()
+
+
+async def get_cache_client(request: Request) -> Redis:
+    return request.app.state.cache_client
+
+
+async def listen_invalidations(cache_client: Redis) -> None:
+    """Evicts keys and tags from the local cache when any worker invalidates them in Redis"""
+    while True:
+        try:
+            async with cache_client.pubsub(ignore_subscribe_messages=True) as pubsub:
+                await pubsub.subscribe(CACHE_INVALIDATION_CHANNEL)
+                # invalidations published while we were not subscribed are lost
+                local_cache.clear()
+                while True:
+                    message = await pubsub.get_message(
+                        ignore_subscribe_messages=True, timeout=CACHE_HEALTH_CHECK_INTERVAL)
+                    if message is not None:
+                        invalidated = json.loads(message['data'])
+                        local_cache.delete(*invalidated.get('keys', ()))
+                        local_cache.invalidate(*invalidated.get('tags', ()))
+        except RedisError:
+            await asyncio.sleep(1)
+
+
+def make_etag(value: bytes) -> str:
+    # the same digest is computed by the invalidation script when it changes counters in place
+    return f'"{hashlib.sha1(value).hexdigest()}"'
+
+
+redis_stats = CacheStats()
+
+
+class CacheEntry(NamedTuple):
+    # serialized JSON
+    value: bytes
+    # soft expiration: after it the value is still served, but recomputed in background
+    expires: float
+    # how long the value took to compute
+    delta: float
+    # when the value was computed
+    computed: float
+    tags: tuple = ()
+    # strong ETag of the value, changes whenever the value does
+    etag: str = ''
+    # versions of the tags read before the value was computed, in the order of the tags
+    versions: tuple = ()
+
+    def is_stale(self) -> bool:
+        # XFetch: the closer to the expiration and the slower the recomputation,
+        # the more likely a request triggers an early refresh
+        return time.time() - self.delta * CACHE_XFETCH_BETA * math.log(1 - random.random()) >= self.expires
 
 
 class RedisCache:
@@ -24,39 +114,258 @@ class RedisCache:
         self.client = cache_client
         self.background_tasks = bg_tasks
 
-    async def get(self, key: Union[UUID, str]):
-        cached_data = await self.client.get(key)
-        return json.loads(cached_data) if cached_data else None
+    async def get(self, key: Union[UUID, str]) -> Optional[bytes]:
+        entry = await self._get_entry(str(key))
+        return entry.value if entry else None
 
-    async def set(
+    async def get_or_set(
             self,
             key: Union[UUID, str],
-            value: Any,
+            func: Callable[..., Awaitable[bytes]],
             *args,
+            tags: Iterable[str] = ()) -> CacheEntry:
+        """Returns cached entry. On a miss only one coroutine per key calls func, the others await its result.
+        Stale entries are returned immediately and refreshed in background"""
+        key = str(key)
+        tags = tuple(tags)
+        entry = await self._get_entry(key)
+        if entry is None:
+            return await single_flight.do(key, self._compute, key, func, args, tags)
+        if entry.is_stale():
+            await self._execute(True, self._refresh, key, entry, func, args)
+        return entry
+
+    async def set(
+            self,
+            key: Union[UUID, str],
+            value: bytes,
             as_task: bool = True,
             ex: int = CACHE_EXPIRATION,
-            **kwargs):
-        json_value = json.dumps(jsonable_encoder(value))
-        if as_task:
-            self.background_tasks.add_task(
-                self.client.set, key, json_value, ex, *args, **kwargs)
-            # fix bug with wrong detection async func by BackgroundTasks
-            self.background_tasks.tasks[0].is_async = True
-        else:
-            await self.client.set(key, json_value, ex, *args, **kwargs)
+            soft_ex: int = CACHE_SOFT_EXPIRATION,
+            delta: float = 0,
+            tags: Iterable[str] = (),
+            versions: Optional[tuple] = None,
+            replica: bool = False) -> CacheEntry:
+        """Stores serialized JSON value computed from the data of the `versions` of its tags (see get_versions).
+        The value is not stored if any of its tags has been written since, as it may miss the write.
+        Writes of other tags don't affect it. Values read from a `replica` are not stored either
+        while it may lag behind the last write of any of their tags"""
+        key = str(key)
+        tags = tuple(tags)
+        if versions is None:
+            versions = await self.get_versions(tags)
+        now = time.time()
+        entry = CacheEntry(value, now + soft_ex, delta, now, tags, make_etag(value), versions)
+        await self._execute(as_task, self._store, key, entry, ex, replica)
+        return entry
 
     async def delete(self, key: Union[UUID, str], as_task: bool = True):
-        if as_task:
-            self.background_tasks.add_task(self.client.delete, key)
-            # fix bug with wrong detection async func by BackgroundTasks
-            self.background_tasks.tasks[0].is_async = True
-        else:
-            await self.client.delete(key)
+        await self.bulk_delete([key], as_task=as_task)
 
     async def bulk_delete(self, keys: list, as_task: bool = True):
+        keys = [str(key) for key in keys]
+        local_cache.delete(*keys)
+        await self._execute(as_task, self._delete, keys)
+
+    async def begin_write(self, tags: Iterable[str]) -> dict[str, int]:
+        """Changes the versions of the tags before the data is written, returns the new versions by tag.
+        Values of the tags computed before are not stored anymore,
+        values computed since may or may not include the write"""
+        tags = tuple(tags)
+        if not tags:
+            return {}
+        versions = await begin_write(args=[CACHE_EXPIRATION, *tags], client=self.client)
+        return dict(zip(tags, map(int, versions)))
+
+    async def invalidate(
+            self,
+            tags: list,
+            counters: Iterable[tuple[str, str, str, int]] = (),
+            write_versions: Optional[dict[str, int]] = None,
+            as_task: bool = True):
+        """Deletes all entries tagged with any of the tags and changes the versions of the tags.
+        Counters are (tag, item id, counter name, change): the counter of the item is changed in place
+        in every entry with the tag computed before the write started (`write_versions` are returned by
+        begin_write). Entries computed since are deleted"""
+        counted = list(counters)
+        changed_counters = [[tag, str(item_id), counter, change] for tag, item_id, counter, change in counted]
+        local_cache.invalidate(*tags, *(tag for tag, *_ in counted))
+        await self._execute(as_task, self._invalidate, tags, changed_counters, write_versions or {})
+
+    async def exists(self, key: str) -> bool:
+        return bool(await self.client.exists(key))
+
+    async def get_versions(self, tags: Iterable[str]) -> tuple:
+        """Versions of the tags, each grows with every write invalidating its tag"""
+        return tuple(map(int, await get_versions(args=[CACHE_EXPIRATION, *tags], client=self.client)))
+
+    async def get_version(self, tag: str) -> int:
+        """Version of the tag, anything derived from the data of the tag can be keyed by it"""
+        return (await self.get_versions([tag]))[0]
+
+    async def add(self, key: str, value: str, ex: int) -> str:
+        """Sets the plain string value if the key doesn't exist, returns the value stored under the key"""
+        async with self.client.pipeline() as pipe:
+            _, stored = await pipe.set(key, value, ex=ex, nx=True).get(key).execute()
+        return stored.decode()
+
+    async def incr(self, key: str, ex: int) -> int:
+        """Increments the counter under the key, returns the new value.
+        The counter expires `ex` seconds after its first increment"""
+        async with self.client.pipeline() as pipe:
+            value, _ = await pipe.incr(key).expire(key, ex, nx=True).execute()
+        return value
+
+    async def stats(self) -> dict:
+        info = await self.client.info('stats')
+        return {
+            'local': {**local_cache.stats.dict(), 'entries': len(local_cache), 'bytes': local_cache.size},
+            'redis': {**redis_stats.dict(), 'evictions': info['evicted_keys']},
+        }
+
+    async def _get_entry(self, key: str) -> Optional[CacheEntry]:
+        entry = local_cache.get(key)
+        if entry is not None:
+            return entry
+        try:
+            fields = await self.client.hmget(key, *CacheEntry._fields)
+        except ResponseError:
+            # value stored in another format, e.g. by previous version of the application
+            fields = [None]
+        return self._decode(key, fields)
+
+    async def _compute(
+            self,
+            key: str,
+            func: Callable[..., Awaitable],
+            args: tuple,
+            tags: tuple,
+            wait: bool = True):
+        if not CACHE_LOCK_ENABLED:
+            return await self._call(key, func, args, tags)
+
+        lock = self.client.lock(f'lock:{key}', timeout=CACHE_LOCK_TIMEOUT)
+        if not await lock.acquire(blocking=False):
+            if not wait:
+                return None
+            entry = await self._wait_for(key, lock.name)
+            if entry is not None:
+                return entry
+            # lock holder failed or is too slow, compute the value ourselves
+            return await self._call(key, func, args, tags)
+        try:
+            # other workers poll the key, so it has to be stored before the lock is released
+            return await self._call(key, func, args, tags, as_task=False)
+        finally:
+            try:
+                await lock.release()
+            except LockError:
+                pass
+
+    async def _call(
+            self,
+            key: str,
+            func: Callable[..., Awaitable],
+            args: tuple,
+            tags: tuple,
+            as_task: bool = True) -> CacheEntry:
+        versions = await self.get_versions(tags)
+        started = time.perf_counter()
+        value = await func(*args)
+        return await self.set(
+            key,
+            value,
+            as_task=as_task,
+            delta=time.perf_counter() - started,
+            tags=tags,
+            versions=versions,
+            replica=reading_replica.get(),
+        )
+
+    async def _refresh(self, key: str, stale_entry: CacheEntry, func: Callable[..., Awaitable], args: tuple):
+        refresh_key = f'refresh:{key}'
+        if refresh_key in single_flight:
+            return
+        entry = await self._get_entry(key)
+        if entry is not None and entry.expires != stale_entry.expires:
+            # already refreshed by another request
+            return
+        try:
+            await single_flight.do(refresh_key, self._compute, key, func, args, stale_entry.tags, False)
+        except Exception:
+            logger.exception('Failed to refresh cache key %s', key)
+
+    async def _wait_for(self, key: str, lock_name: str) -> Optional[CacheEntry]:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + CACHE_LOCK_TIMEOUT
+        while loop.time() < deadline:
+            await asyncio.sleep(CACHE_LOCK_POLL_INTERVAL)
+            async with self.client.pipeline(transaction=False) as pipe:
+                fields, locked = await pipe.hmget(key, *CacheEntry._fields).exists(lock_name).execute()
+            if fields[0] is not None or not locked:
+                return self._decode(key, fields)
+        return None
+
+    def _decode(self, key: str, fields: list) -> Optional[CacheEntry]:
+        json_value = fields[0]
+        if json_value is None:
+            redis_stats.misses += 1
+            return None
+        redis_stats.hits += 1
+        entry = CacheEntry(
+            json_value,
+            float(fields[1]),
+            float(fields[2]),
+            float(fields[3]),
+            tuple(json.loads(fields[4])),
+            fields[5].decode(),
+            tuple(json.loads(fields[6])),
+        )
+        local_cache.set(key, entry, len(json_value), tags=entry.tags)
+        return entry
+
+    async def _store(self, key: str, entry: CacheEntry, ex: int, replica: bool = False) -> None:
+        fields = {**entry._asdict(), 'tags': json.dumps(entry.tags), 'versions': json.dumps(entry.versions)}
+        stored = await store_entry(
+            keys=[key],
+            args=[
+                ex,
+                fields['tags'],
+                fields['versions'],
+                int(replica),
+                *(item for field in fields.items() for item in field),
+            ],
+            client=self.client,
+        )
+        # the local tier only keeps what Redis keeps, invalidations of the skipped value may be already gone
+        if stored:
+            local_cache.set(key, entry, len(entry.value), ex, entry.tags)
+
+    async def _delete(self, keys: list) -> None:
+        async with self.client.pipeline(transaction=False) as pipe:
+            pipe.delete(*keys)
+            pipe.publish(CACHE_INVALIDATION_CHANNEL, json.dumps({'keys': keys}))
+            await pipe.execute()
+
+    async def _invalidate(self, tags: list, counters: list, write_versions: dict) -> None:
+        message = json.dumps({'tags': [*tags, *(counter[0] for counter in counters)]})
+        await invalidate_tags(
+            keys=tags,
+            args=[
+                CACHE_INVALIDATION_CHANNEL,
+                message,
+                json.dumps(counters),
+                json.dumps(write_versions),
+                CACHE_EXPIRATION,
+                int(DATABASE_STICKY_SECONDS * 1000),
+            ],
+            client=self.client,
+        )
+
+    async def _execute(self, as_task: bool, func: Callable, *args, **kwargs) -> None:
         if as_task:
-            self.background_tasks.add_task(self.client.delete, *keys)
+            self.background_tasks.add_task(func, *args, **kwargs)
             # fix bug with wrong detection async func by BackgroundTasks
-            self.background_tasks.tasks[0].is_async = True
+            self.background_tasks.tasks[-1].is_async = True
         else:
-            await self.client.delete(*keys)
+            await func(*args, **kwargs)
@@ -0,0 +1,162 @@
+from redis.commands.core import AsyncScript  # type: ignore
+
+# every tag has a version, changed by the writes invalidating the tag.
+# A version key is named after its tag: '<tag>:version'.
+# '<tag>:written' exists while the replicas may still miss the last write of the tag
+VERSIONS = b'''
+local function version_key(tag)
+    return tag .. ':version'
+end
+
+local function written_key(tag)
+    return tag .. ':written'
+end
+
+-- a lost version restarts from the current time in microseconds, so it never repeats a previous one.
+-- Versions expire with the entries computed from them, `ex` is the expiration of the entries
+local function get_version(tag, ex)
+    local key = version_key(tag)
+    if redis.call('EXISTS', key) == 0 then
+        local now = redis.call('TIME')
+        redis.call('SET', key, string.format('%.0f', now[1] * 1000000 + now[2]))
+    end
+    redis.call('EXPIRE', key, ex)
+    return tonumber(redis.call('GET', key))
+end
+
+local function bump_version(tag, ex)
+    get_version(tag, ex)
+    return redis.call('INCR', version_key(tag))
+end
+'''
+
+# ARGV[1]: expiration, ARGV[2:]: tags
+GET_VERSIONS = VERSIONS + b'''
+local versions = {}
+for i = 2, #ARGV do
+    table.insert(versions, get_version(ARGV[i], ARGV[1]))
+end
+return versions
+'''
+
+# ARGV[1]: expiration, ARGV[2:]: tags the write changes
+BEGIN_WRITE = VERSIONS + b'''
+local versions = {}
+for i = 2, #ARGV do
+    table.insert(versions, bump_version(ARGV[i], ARGV[1]))
+end
+return versions
+'''
+
+# KEYS[1]: key of the entry
+# ARGV[1]: expiration, ARGV[2]: json list of tag sets, ARGV[3]: json list of the versions of the tags
+# the value was computed from, ARGV[4]: '1' if the value was read from a replica
+# ARGV[5:]: fields of the entry and their values
+STORE_ENTRY = VERSIONS + b'''
+local tags = cjson.decode(ARGV[2])
+local versions = cjson.decode(ARGV[3])
+for i, tag in ipairs(tags) do
+    -- a tag of the entry has been written since the value was computed, the value may miss the write
+    if tonumber(redis.call('GET', version_key(tag))) ~= versions[i] then
+        return 0
+    end
+    -- the replica may not have the last write yet, the writer would read the value from the cache
+    if ARGV[4] == '1' and redis.call('EXISTS', written_key(tag)) == 1 then
+        return 0
+    end
+end
+redis.call('DEL', KEYS[1])
+redis.call('HSET', KEYS[1], unpack(ARGV, 5))
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+for _, tag in ipairs(tags) do
+    redis.call('SADD', tag, KEYS[1])
+    redis.call('EXPIRE', tag, ARGV[1])
+end
+return 1
+'''
+
+# KEYS: tag sets to invalidate
+# ARGV[1]: invalidation channel, ARGV[2]: message for local caches of the workers
+# ARGV[3]: json list of counters to change in place: [tag set, item id, counter name, change]
+# ARGV[4]: json object of the versions the write started with by tag of the counters (see BEGIN_WRITE)
+# ARGV[5]: expiration, ARGV[6]: milliseconds the replicas may lag behind
+INVALIDATE_TAGS = VERSIONS + b'''
+local write_versions = cjson.decode(ARGV[4])
+local ex = ARGV[5]
+local keys = {}
+local written = {}
+
+local function change_counter(item, item_id, counter, change)
+    if item.id == item_id and item[counter] ~= nil then
+        item[counter] = item[counter] + change
+        return true
+    end
+    return false
+end
+
+local function entry_version(entry, tag)
+    for i, entry_tag in ipairs(cjson.decode(entry[2])) do
+        if entry_tag == tag then
+            return cjson.decode(entry[3])[i]
+        end
+    end
+    return nil
+end
+
+for _, c in ipairs(cjson.decode(ARGV[3])) do
+    local tag, item_id, counter, change = c[1], c[2], c[3], c[4]
+    local write_version = write_versions[tag]
+    table.insert(written, tag)
+    for _, key in ipairs(redis.call('SMEMBERS', tag)) do
+        local entry = redis.call('HMGET', key, 'value', 'tags', 'versions')
+        if entry[1] then
+            local version = entry_version(entry, tag)
+            -- an older version was computed and stored before the write started, the value misses the write
+            if version ~= nil and write_version ~= nil and version < write_version then
+                local value = cjson.decode(entry[1])
+                local changed = false
+                if value.id ~= nil then
+                    changed = change_counter(value, item_id, counter, change)
+                else
+                    for _, item in ipairs(value) do
+                        changed = change_counter(item, item_id, counter, change) or changed
+                    end
+                end
+                if changed then
+                    local encoded = cjson.encode(value)
+                    redis.call('HSET', key, 'value', encoded, 'etag', '"' .. redis.sha1hex(encoded) .. '"')
+                end
+            else
+                -- computed since the write started, it may or may not include it
+                table.insert(keys, key)
+            end
+        end
+    end
+end
+
+for _, tag in ipairs(KEYS) do
+    for _, key in ipairs(redis.call('SMEMBERS', tag)) do
+        table.insert(keys, key)
+    end
+    table.insert(keys, tag)
+    table.insert(written, tag)
+end
+for i = 1, #keys, 1000 do
+    redis.call('DEL', unpack(keys, i, math.min(i + 999, #keys)))
+end
+-- values of the tags computed during the write and stored after it are skipped
+for _, tag in ipairs(written) do
+    bump_version(tag, ex)
+    if tonumber(ARGV[6]) > 0 then
+        redis.call('SET', written_key(tag), 1, 'PX', ARGV[6])
+    end
+end
+redis.call('PUBLISH', ARGV[1], ARGV[2])
+return #keys
+'''
+
+# scripts are not bound to a client, it is passed on every call
+get_versions = AsyncScript(None, GET_VERSIONS)
+begin_write = AsyncScript(None, BEGIN_WRITE)
+store_entry = AsyncScript(None, STORE_ENTRY)
+invalidate_tags = AsyncScript(None, INVALIDATE_TAGS)
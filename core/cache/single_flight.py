@@ -0,0 +1,47 @@
+import asyncio
+from typing import Any, Awaitable, Callable
+
+
+class SingleFlight:
+    """Runs at most one call per key at a time, concurrent callers await the result of the running one"""
+
+    def __init__(self):
+        self._calls: dict[str, asyncio.Future] = {}
+
+    async def do(self, key: str, func: Callable[..., Awaitable], *args, **kwargs) -> Any:
+        call = self._calls.get(key)
+        while call is not None:
+            try:
+                return await asyncio.shield(call)
+            except asyncio.CancelledError:
+                # only the running call was cancelled, not this caller: run it again
+                if not call.cancelled():
+                    raise
+            call = self._calls.get(key)
+
+        call = asyncio.get_running_loop().create_future()
+        self._calls[key] = call
+        try:
+            result = await func(*args, **kwargs)
+        except asyncio.CancelledError:
+            call.cancel()
+            raise
+        except Exception as ex:
+            call.set_exception(ex)
+            # mark exception as retrieved when nobody else was waiting for it
+            call.exception()
+            raise
+        else:
+            call.set_result(result)
+            return result
+        finally:
+            del self._calls[key]
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._calls
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+
+single_flight = SingleFlight()
@@ -1,14 +1,134 @@
+import math
+import random
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+from fastapi import Request, Response
+from sqlalchemy.exc import TimeoutError
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import declarative_base, sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, Pool, QueuePool
+
+from core.settings import (
+    DATABASE_MAX_OVERFLOW,
+    DATABASE_PGBOUNCER,
+    DATABASE_POOL_PRE_PING,
+    DATABASE_POOL_RECYCLE,
+    DATABASE_POOL_SIZE,
+    DATABASE_POOL_TIMEOUT,
+    DATABASE_REPLICA_URLS,
+    DATABASE_STICKY_SECONDS,
+    DATABASE_URL,
+)
+
+READ_METHODS = ('GET', 'HEAD')
+# set on the responses to writes, reads of the client go to the primary while it lasts
+STICKY_COOKIE = 'read_primary'
+# whether the current request reads from a replica, what it reads may miss the last writes
+reading_replica: ContextVar[bool] = ContextVar('reading_replica', default=False)
+
+
+class PoolStats:
+
+    def __init__(self):
+        self.waiters = 0
+        self.acquisitions = 0
+        self.timeouts = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    def dict(self) -> dict:
+        return {
+            'waiters': self.waiters,
+            'acquisitions': self.acquisitions,
+            'timeouts': self.timeouts,
+            'wait_time': self.wait_time,
+            'max_wait_time': self.max_wait_time,
+        }
+
+
+class MonitoredPool(AsyncAdaptedQueuePool):
+    """Queue pool counting the requests waiting for a connection and how long they wait,
+    including the time to open a new connection"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+    def _do_get(self):
+        self.stats.waiters += 1
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except TimeoutError:
+            self.stats.timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - started
+            self.stats.waiters -= 1
+            self.stats.wait_time += waited
+            self.stats.max_wait_time = max(self.stats.max_wait_time, waited)
+        self.stats.acquisitions += 1
+        return connection
+
+    def metrics(self) -> dict:
+        return {
+            'size': self.size(),
+            'checked_out': self.checkedout(),
+            'checked_in': self.checkedin(),
+            'overflow': max(self.overflow(), 0),
+            **self.stats.dict(),
+        }
+
+
+def create_engine(url: Optional[str] = DATABASE_URL, poolclass: type[Pool] = MonitoredPool, **options):
+    """Engine with the pool configured in the settings, `options` override them.
+    Pools that keep no connections, e.g. NullPool, only take the connection settings"""
+    connect_args = {}
+    if DATABASE_PGBOUNCER:
+        # PgBouncer in transaction pooling mode may run the next statement on another server connection,
+        # statements prepared on the previous one are not there
+        connect_args = {'statement_cache_size': 0, 'prepared_statement_cache_size': 0}
+    pool_options: dict = {'pool_recycle': DATABASE_POOL_RECYCLE, 'pool_pre_ping': DATABASE_POOL_PRE_PING}
+    if issubclass(poolclass, QueuePool):
+        pool_options.update(
+            pool_size=DATABASE_POOL_SIZE,
+            max_overflow=DATABASE_MAX_OVERFLOW,
+            pool_timeout=DATABASE_POOL_TIMEOUT,
+        )
+    return create_async_engine(url, poolclass=poolclass, connect_args=connect_args, **{**pool_options, **options})
+
+
+class SessionRouter:
+    """Chooses the database of a request: reads go to a random replica, writes to the primary.
+    Reads of a client go to the primary too while its sticky cookie, set by its writes, lasts,
+    so that it reads its own writes the replicas may not have yet"""
+
+    def __init__(self, primary: sessionmaker, replicas: list[sessionmaker]):
+        self.primary = primary
+        self.replicas = replicas
+
+    def for_request(self, request: Request) -> sessionmaker:
+        if not self.replicas or request.method not in READ_METHODS or STICKY_COOKIE in request.cookies:
+            return self.primary
+        return random.choice(self.replicas)
 
-from core.settings import DATABASE_URL
 
-engine = create_async_engine(DATABASE_URL)
+engine = create_engine()
 Session = sessionmaker(engine, class_=AsyncSession)
+replica_engines = [create_engine(url) for url in DATABASE_REPLICA_URLS]
+session_router = SessionRouter(
+    Session,
+    [sessionmaker(replica_engine, class_=AsyncSession) for replica_engine in replica_engines],
+)
 Base = declarative_base()
 
 
-async def get_session() -> AsyncSession:
-    async_session = Session()
-    async with async_session as session:
+async def get_session(request: Request, response: Response) -> AsyncSession:
+    if request.method not in READ_METHODS and session_router.replicas:
+        response.set_cookie(STICKY_COOKIE, '1', max_age=math.ceil(DATABASE_STICKY_SECONDS), httponly=True)
+    session_factory = session_router.for_request(request)
+    reading_replica.set(session_factory is not session_router.primary)
+    async with session_factory() as session:
         yield session
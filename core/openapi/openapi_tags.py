@@ -3,4 +3,5 @@ tags_metadata = [
     {'name': 'submenu', 'description': 'Подменю'},
     {'name': 'dish', 'description': 'Блюда'},
     {'name': 'auth', 'description': 'Авторизация и регистрация'},
+    {'name': 'metrics', 'description': 'Метрики'},
 ]
@@ -0,0 +1,37 @@
+from typing import Optional
+from uuid import UUID
+
+from fastapi import Query
+from sqlalchemy import func
+from sqlalchemy.sql import Select
+
+from core.settings import PAGE_MAX_SIZE
+
+
+class Page:
+    """Keyset pagination: at most `limit` items ordered by id, following the item with id `after`.
+    Unlike an offset, the cursor costs one index lookup however deep the page is.
+    Without `limit` all the items are returned, as the lists were before they were paginated"""
+
+    def __init__(
+            self,
+            limit: Optional[int] = Query(None, ge=1, le=PAGE_MAX_SIZE, description='Размер страницы'),
+            after: Optional[UUID] = Query(None, description='id последнего элемента предыдущей страницы')):
+        self.limit = limit
+        self.after = after
+
+    def __str__(self) -> str:
+        # part of the cache keys of the page
+        return f'limit={self.limit or ""}&after={self.after or ""}'
+
+
+def paginate(query: Select, model, page: Optional[Page] = None, title: Optional[str] = None) -> Select:
+    """Filters the query of the model by a case-insensitive part of the title and selects the page"""
+    if title is not None:
+        query = query.filter(func.lower(model.title).contains(title.lower(), autoescape=True))
+    if page is None:
+        return query.order_by(model.id)
+    if page.after is not None:
+        query = query.filter(model.id > page.after)
+    query = query.order_by(model.id)
+    return query if page.limit is None else query.limit(page.limit)
@@ -10,15 +10,70 @@ DATABASE_USER = os.getenv('POSTGRES_USER')
 DATABASE_PASSWORD = os.getenv('POSTGRES_PASSWORD')
 DATABASE_URL = os.getenv('DATABASE_URL')
 TEST_DB_NAME = os.getenv('TEST_DB_NAME', default='test_database')
+# connections kept open by each process, requests over size + overflow wait up to the timeout
+DATABASE_POOL_SIZE = int(os.getenv('DATABASE_POOL_SIZE', default=5))
+DATABASE_MAX_OVERFLOW = int(os.getenv('DATABASE_MAX_OVERFLOW', default=10))
+DATABASE_POOL_TIMEOUT = float(os.getenv('DATABASE_POOL_TIMEOUT', default=30))
+# seconds a connection is reused, -1 for no limit
+DATABASE_POOL_RECYCLE = int(os.getenv('DATABASE_POOL_RECYCLE', default=-1))
+DATABASE_POOL_PRE_PING = os.getenv('DATABASE_POOL_PRE_PING', default='false').lower() == 'true'
+# comma separated urls of the read replicas, GET requests are served by them
+DATABASE_REPLICA_URLS = [url for url in os.getenv('DATABASE_REPLICA_URLS', default='').split(',') if url]
+# seconds reads of a client stay on the primary after its write, longer than the replication lag
+DATABASE_STICKY_SECONDS = float(os.getenv('DATABASE_STICKY_SECONDS', default=5))
+# connecting through PgBouncer in transaction pooling mode
+DATABASE_PGBOUNCER = os.getenv('DATABASE_PGBOUNCER', default='false').lower() == 'true'
 
 CACHE_DB_NUM = os.getenv('REDIS_DB_NUM')
 TEST_CACHE_DB_NUM = '7'
 CACHE_URL = os.getenv('CACHE_URL')
+CACHE_NAMESPACE = os.getenv('CACHE_NAMESPACE', default='menu')
+# bump after changing the format of cached values
+CACHE_VERSION = 7
 CACHE_EXPIRATION = 3600
+CACHE_SOFT_EXPIRATION = int(os.getenv('CACHE_SOFT_EXPIRATION', default=300))
+CACHE_XFETCH_BETA = float(os.getenv('CACHE_XFETCH_BETA', default=1))
+CACHE_POOL_MAX_CONNECTIONS = int(os.getenv('CACHE_POOL_MAX_CONNECTIONS', default=50))
+CACHE_POOL_TIMEOUT = float(os.getenv('CACHE_POOL_TIMEOUT', default=5))
+CACHE_HEALTH_CHECK_INTERVAL = int(os.getenv('CACHE_HEALTH_CHECK_INTERVAL', default=30))
+CACHE_SOCKET_TIMEOUT = float(os.getenv('CACHE_SOCKET_TIMEOUT', default=1))
+CACHE_SOCKET_CONNECT_TIMEOUT = float(os.getenv('CACHE_SOCKET_CONNECT_TIMEOUT', default=1))
+CACHE_LOCAL_MAX_ENTRIES = int(os.getenv('CACHE_LOCAL_MAX_ENTRIES', default=1024))
+CACHE_LOCAL_MAX_BYTES = int(os.getenv('CACHE_LOCAL_MAX_BYTES', default=16 * 1024 * 1024))
+CACHE_LOCAL_EXPIRATION = int(os.getenv('CACHE_LOCAL_EXPIRATION', default=30))
+CACHE_INVALIDATION_CHANNEL = 'cache:invalidate'
+CACHE_LOCK_ENABLED = os.getenv('CACHE_LOCK_ENABLED', default='false').lower() == 'true'
+CACHE_LOCK_TIMEOUT = float(os.getenv('CACHE_LOCK_TIMEOUT', default=10))
+CACHE_LOCK_POLL_INTERVAL = float(os.getenv('CACHE_LOCK_POLL_INTERVAL', default=0.05))
+# search results are cached once their query has been searched that many times within the window, seconds
+CACHE_SEARCH_MIN_HITS = int(os.getenv('CACHE_SEARCH_MIN_HITS', default=3))
+CACHE_SEARCH_HITS_WINDOW = int(os.getenv('CACHE_SEARCH_HITS_WINDOW', default=600))
+# sent with cached reads, e.g. 'public, max-age=5' lets clients and CDNs serve them without asking
+CACHE_CONTROL = os.getenv('CACHE_CONTROL', default='no-cache')
 CELERY_BROKER_URL = os.getenv('CELERY_BROKER_URL')
+# task states are kept apart from the cache, its evictions and flushes would lose them
+CELERY_RESULT_BACKEND = os.getenv('CELERY_RESULT_BACKEND')
 
 JWT_SECRET = os.getenv('JWT_SECRET')
 JWT_ALGORITHM = 'HS256'
 JWT_EXPIRATION = 3600
+# verified tokens kept in each process
+TOKEN_CACHE_MAX_ENTRIES = int(os.getenv('TOKEN_CACHE_MAX_ENTRIES', default=10_000))
+TOKEN_CACHE_MAX_BYTES = int(os.getenv('TOKEN_CACHE_MAX_BYTES', default=8 * 1024 * 1024))
+# bcrypt cost: every round doubles the time of hashing and of signing in
+PASSWORD_HASH_ROUNDS = int(os.getenv('PASSWORD_HASH_ROUNDS', default=12))
+# passwords hashed at the same time, each takes a CPU core
+PASSWORD_HASH_CONCURRENCY = int(os.getenv('PASSWORD_HASH_CONCURRENCY', default=2))
+
+# search results returned unless the client asks for another page size, lists are returned whole
+PAGE_SIZE = int(os.getenv('PAGE_SIZE', default=100))
+PAGE_MAX_SIZE = int(os.getenv('PAGE_MAX_SIZE', default=1000))
+
+# items a batch request can create, update or delete each
+BATCH_MAX_SIZE = int(os.getenv('BATCH_MAX_SIZE', default=10_000))
 
 GENERATED_FILES_DIRNAME = 'generated_files'
+# exports are rebuilt after the catalog changes, unchanged catalog is served from the built file until it expires
+EXPORT_EXPIRATION = int(os.getenv('EXPORT_EXPIRATION', default=24 * 3600))
+# bigger catalogs are exported by the worker instead of being streamed in the request
+EXPORT_STREAMING_MAX_ROWS = int(os.getenv('EXPORT_STREAMING_MAX_ROWS', default=100_000))
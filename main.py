@@ -1,27 +1,53 @@
+import asyncio
+
 import uvicorn
 from celery import Celery
 from fastapi import APIRouter, FastAPI
 
 from apps.auth.api import auth
 from apps.menu.api import dish, menu, submenu
+from apps.monitoring.api import metrics
+from core.cache.conditional import ConditionalGetMiddleware
+from core.cache.redis import (
+    close_cache_client,
+    create_cache_client,
+    listen_invalidations,
+)
 from core.openapi.openapi_tags import tags_metadata
-from core.settings import CELERY_BROKER_URL
+from core.settings import CELERY_BROKER_URL, CELERY_RESULT_BACKEND, EXPORT_EXPIRATION
 
-app = Celery('tasks', broker=CELERY_BROKER_URL, include=['apps.menu.tasks'])
-app.conf.accept_content = ['application/json',
-                           'application/x-python-serialize']
+app = Celery('tasks', broker=CELERY_BROKER_URL, backend=CELERY_RESULT_BACKEND, include=['apps.menu.tasks'])
+app.conf.accept_content = ['application/json']
+app.conf.task_track_started = True
+app.conf.result_expires = EXPORT_EXPIRATION
 
 fastapi_app = FastAPI(title='Restaurant API', openapi_tags=tags_metadata)
 fastapi_app.state.celery = app
+fastapi_app.add_middleware(ConditionalGetMiddleware)
 
 router = APIRouter(prefix='/api/v1')
 
 router.include_router(menu.router)
 router.include_router(submenu.router)
 router.include_router(dish.router)
+router.include_router(dish.search_router)
 router.include_router(auth.router)
+router.include_router(metrics.router)
 fastapi_app.include_router(router)
 
 
+@fastapi_app.on_event('startup')
+async def startup():
+    fastapi_app.state.cache_client = create_cache_client()
+    fastapi_app.state.cache_listener = asyncio.create_task(
+        listen_invalidations(fastapi_app.state.cache_client))
+
+
+@fastapi_app.on_event('shutdown')
+async def shutdown():
+    fastapi_app.state.cache_listener.cancel()
+    await close_cache_client(fastapi_app.state.cache_client)
+
+
 if __name__ == '__main__':
     uvicorn.run('main:fastapi_app', reload=True)
@@ -8,12 +8,12 @@ import pytest_asyncio
 from asyncpg import ConnectionDoesNotExistError, InvalidCatalogNameError
 from httpx import AsyncClient
 from redis.asyncio.client import Redis  # type: ignore
-from redis.asyncio.connection import ConnectionPool  # type: ignore
 from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
 
 from apps.menu.crud import DishCRUD, MenuCRUD, SubmenuCRUD
-from core.cache.redis import get_cache_client
+from core.cache.local import local_cache
+from core.cache.redis import close_cache_client, create_cache_client, get_cache_client
 from core.database import Base, get_session
 from core.settings import (
     CACHE_DB_NUM,
@@ -38,12 +38,7 @@ async def get_test_session() -> AsyncSession:
         yield async_session
 
 
-async def get_test_cache_client():
-    test_cache_url = CACHE_URL.replace(CACHE_DB_NUM, TEST_CACHE_DB_NUM)
-    connection_pool = ConnectionPool.from_url(url=test_cache_url)
-    async_cache_client = Redis(connection_pool=connection_pool)
-    async with async_cache_client as cache_client:
-        yield cache_client
+test_cache_url = CACHE_URL.replace(CACHE_DB_NUM, TEST_CACHE_DB_NUM)  # type: ignore
 
 
 async def create_db_if_not_exists():
@@ -73,9 +68,23 @@ def event_loop() -> Generator:
 
 
 @pytest_asyncio.fixture(scope='session')
-async def client():
+async def cache_client() -> Redis:
+    test_cache_client = create_cache_client(test_cache_url)
+    yield test_cache_client
+    await close_cache_client(test_cache_client)
+
+
+@pytest_asyncio.fixture(autouse=True)
+async def clear_cache(cache_client: Redis):
+    # tests change the database directly, bypassing cache invalidation
+    local_cache.clear()
+    await cache_client.flushdb()
+
+
+@pytest_asyncio.fixture(scope='session')
+async def client(cache_client: Redis):
     fastapi_app.dependency_overrides[get_session] = get_test_session
-    fastapi_app.dependency_overrides[get_cache_client] = get_test_cache_client
+    fastapi_app.dependency_overrides[get_cache_client] = lambda: cache_client
     async with AsyncClient(app=fastapi_app, base_url='http://test') as async_client:
         yield async_client
 
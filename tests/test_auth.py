@@ -0,0 +1,38 @@
+import pytest
+from httpx import AsyncClient
+
+from apps.auth.crud import UserCRUD
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures('session')
+class TestTokenCache:
+
+    async def test_verified_token_cached_ok(self, client: AsyncClient):
+        token = (await client.post('/api/v1/auth/sing_up', json={
+            'email': 'token_cache@example.com', 'username': 'token_cache', 'password': 'password'})).json()
+        headers = {'Authorization': f'Bearer {token["access_token"]}'}
+        before = (await client.get('/api/v1/metrics/tokens')).json()
+
+        first = await client.get('/api/v1/auth/user', headers=headers)
+        second = await client.get('/api/v1/auth/user', headers=headers)
+        forged = await client.get('/api/v1/auth/user', headers={'Authorization': f'{headers["Authorization"]}x'})
+        after = (await client.get('/api/v1/metrics/tokens')).json()
+
+        assert first.json() == second.json()
+        assert first.json()['username'] == 'token_cache'
+        assert forged.status_code == 401
+        assert (after['hits'] - before['hits'], after['misses'] - before['misses']) == (1, 2)
+        assert 0 < after['hit_ratio'] <= 1
+
+    async def test_cached_user_not_shared_ok(self, client: AsyncClient):
+        token = (await client.post('/api/v1/auth/sing_up', json={
+            'email': 'token_copy@example.com', 'username': 'token_copy', 'password': 'password'})).json()
+
+        first = await UserCRUD._validate_token(token['access_token'])
+        first.username = 'changed'
+        second = await UserCRUD._validate_token(token['access_token'])
+        third = await UserCRUD._validate_token(token['access_token'])
+        second.username = 'changed'
+
+        assert third.username == 'token_copy'
@@ -0,0 +1,345 @@
+import asyncio
+import json
+import time
+
+import pytest
+from httpx import AsyncClient
+from redis.asyncio.client import Redis  # type: ignore
+from starlette.background import BackgroundTasks
+
+from apps.menu import cache as rules
+from core.cache.cache import make_key, make_tag
+from core.cache.local import LocalCache
+from core.cache.redis import CacheEntry, RedisCache, make_etag
+from core.cache.single_flight import SingleFlight
+from core.pagination import Page
+from core.settings import CACHE_SEARCH_MIN_HITS
+
+
+class TestLocalCache:
+
+    def test_invalidate_by_tag(self):
+        cache = LocalCache(max_entries=10, max_bytes=1024, ex=60)
+        cache.set('menu', 1, 1, tags=('menu:1',))
+        cache.set('submenu', 2, 1, tags=('submenu:1', 'menu:1:subtree'))
+        cache.set('other', 3, 1, tags=('menu:2',))
+        cache.invalidate('menu:1', 'menu:1:subtree')
+
+        assert cache.get('menu') is None
+        assert cache.get('submenu') is None
+        assert cache.get('other') == 3
+
+    def test_lru_eviction_by_entries(self):
+        cache = LocalCache(max_entries=2, max_bytes=1024, ex=60)
+        cache.set('a', 1, 1)
+        cache.set('b', 2, 1)
+        assert cache.get('a') == 1
+        cache.set('c', 3, 1)
+
+        assert cache.get('b') is None
+        assert cache.get('a') == 1
+        assert cache.get('c') == 3
+        assert cache.stats.evictions == 1
+
+    def test_eviction_by_size(self):
+        cache = LocalCache(max_entries=10, max_bytes=10, ex=60)
+        cache.set('a', 'a', 6)
+        cache.set('b', 'b', 6)
+        cache.set('too_big', 'c', 11)
+
+        assert cache.get('a') is None
+        assert cache.get('b') == 'b'
+        assert cache.get('too_big') is None
+        assert cache.size == 6
+
+    def test_expiration(self):
+        cache = LocalCache(max_entries=10, max_bytes=1024, ex=60)
+        cache.set('a', 1, 1, ex=0)
+
+        assert cache.get('a') is None
+        assert cache.stats.misses == 1
+        assert len(cache) == 0
+
+
+class TestCacheEntry:
+
+    def test_is_stale(self):
+        now = time.time()
+        assert CacheEntry('value', now - 1, 0, now).is_stale()
+        assert not CacheEntry('value', now + 60, 0, now).is_stale()
+        assert CacheEntry('value', now + 60, 10 ** 9, now).is_stale()
+
+
+@pytest.mark.asyncio
+class TestSingleFlight:
+
+    async def test_concurrent_calls_coalesced(self):
+        single_flight = SingleFlight()
+        calls = []
+
+        async def compute(value):
+            calls.append(value)
+            await asyncio.sleep(0.01)
+            return value
+
+        results = await asyncio.gather(*(single_flight.do('key', compute, 1) for _ in range(10)))
+
+        assert results == [1] * 10
+        assert calls == [1]
+        assert len(single_flight) == 0
+
+    async def test_exception_propagated_to_waiters(self):
+        single_flight = SingleFlight()
+
+        async def compute():
+            await asyncio.sleep(0.01)
+            raise ValueError('db error')
+
+        results = await asyncio.gather(*(single_flight.do('key', compute) for _ in range(3)), return_exceptions=True)
+
+        assert all(isinstance(result, ValueError) for result in results)
+        assert len(single_flight) == 0
+
+    async def test_waiters_recompute_when_running_call_cancelled(self):
+        single_flight = SingleFlight()
+        calls = []
+
+        async def compute(value):
+            calls.append(value)
+            await asyncio.sleep(0.01)
+            return value
+
+        running = asyncio.create_task(single_flight.do('key', compute, 1))
+        await asyncio.sleep(0)
+        waiters = [asyncio.create_task(single_flight.do('key', compute, 1)) for _ in range(2)]
+        await asyncio.sleep(0)
+        running.cancel()
+        results = await asyncio.gather(*waiters)
+
+        assert running.cancelled()
+        assert results == [1, 1]
+        assert calls == [1, 1]
+        assert len(single_flight) == 0
+
+
+@pytest.mark.asyncio
+class TestCacheMetrics:
+
+    async def test_get_cache_metrics_ok(self, client: AsyncClient):
+        response = await client.get('/api/v1/metrics/cache')
+
+        assert response.status_code == 200
+        assert set(response.json()) == {'local', 'redis'}
+        assert set(response.json()['local']) == {'hits', 'misses', 'evictions', 'entries', 'bytes'}
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures('session')
+class TestCacheInvalidation:
+
+    async def test_counts_invalidated_ok(self, client: AsyncClient):
+        menu = (await client.post('/api/v1/menus/', json={'title': 'cache_menu', 'description': 'desc'})).json()
+        menu_url = f'/api/v1/menus/{menu["id"]}'
+        assert (await client.get(menu_url)).json()['submenus_count'] == 0
+        assert (await client.get(f'{menu_url}/submenus/')).json() == []
+
+        submenu = (await client.post(f'{menu_url}/submenus/', json={'title': 'cache_submenu', 'description': 'desc'})).json()
+        submenu_url = f'{menu_url}/submenus/{submenu["id"]}'
+        assert (await client.get(menu_url)).json()['submenus_count'] == 1
+        assert (await client.get(submenu_url)).json()['dishes_count'] == 0
+        assert (await client.get(f'{submenu_url}/dishes/')).json() == []
+
+        dish = (await client.post(
+            f'{submenu_url}/dishes/', json={'title': 'cache_dish', 'description': 'desc', 'price': '1.50'})).json()
+        dish_url = f'{submenu_url}/dishes/{dish["id"]}'
+        assert (await client.get(menu_url)).json()['dishes_count'] == 1
+        assert (await client.get(submenu_url)).json()['dishes_count'] == 1
+        assert (await client.get(f'{menu_url}/submenus/')).json()[0]['dishes_count'] == 1
+        assert len((await client.get(f'{submenu_url}/dishes/')).json()) == 1
+        assert (await client.get(dish_url)).json()['title'] == 'cache_dish'
+
+        await client.patch(dish_url, json={'title': 'updated_dish', 'description': 'desc', 'price': '2.00'})
+        assert (await client.get(dish_url)).json()['title'] == 'updated_dish'
+        assert (await client.get(f'{submenu_url}/dishes/')).json()[0]['price'] == '2.00'
+
+        await client.delete(submenu_url)
+        menu_from_response = (await client.get(menu_url)).json()
+        assert (menu_from_response['submenus_count'], menu_from_response['dishes_count']) == (0, 0)
+        assert (await client.get(dish_url)).status_code == 404
+
+        submenu = (await client.post(f'{menu_url}/submenus/', json={'title': 'cache_submenu', 'description': 'desc'})).json()
+        submenu_url = f'{menu_url}/submenus/{submenu["id"]}'
+        assert (await client.get(submenu_url)).status_code == 200
+
+        await client.delete(menu_url)
+        assert (await client.get(menu_url)).status_code == 404
+        assert (await client.get(submenu_url)).status_code == 404
+        assert menu['id'] not in [item['id'] for item in (await client.get('/api/v1/menus/')).json()]
+
+    async def test_counts_changed_in_place_ok(self, client: AsyncClient, cache_client: Redis):
+        menu = (await client.post('/api/v1/menus/', json={'title': 'counted_menu', 'description': 'desc'})).json()
+        menu_url = f'/api/v1/menus/{menu["id"]}'
+        menu_key = make_key(rules.MENU_KEY, {'menu_id': menu['id']})
+        await client.get(menu_url)
+
+        await client.post(f'{menu_url}/submenus/', json={'title': 'counted_submenu', 'description': 'desc'})
+
+        assert json.loads(await cache_client.hget(menu_key, 'value'))['submenus_count'] == 1
+        await client.delete(menu_url)
+
+    async def test_version_changed_by_writes_ok(self, client: AsyncClient, cache_client: Redis):
+        cache = RedisCache(BackgroundTasks(), cache_client)
+        catalog, menus = make_tag(rules.CATALOG, {}), make_tag(rules.MENUS, {})
+        versions = await cache.get_versions([catalog, menus])
+        assert await cache.get_versions([catalog, menus]) == versions
+
+        menu = (await client.post('/api/v1/menus/', json={'title': 'versioned_menu', 'description': 'desc'})).json()
+        menu_tag = make_tag(rules.MENU, {'menu_id': menu['id']})
+        menu_version = await cache.get_version(menu_tag)
+        changed = await cache.get_versions([catalog, menus])
+        assert all(new > old for new, old in zip(changed, versions))
+
+        await client.patch(f'/api/v1/menus/{menu["id"]}', json={'title': 'renamed_menu', 'description': 'desc'})
+        assert await cache.get_version(menu_tag) > menu_version
+        await client.delete(f'/api/v1/menus/{menu["id"]}')
+
+    async def test_value_computed_before_write_not_stored_ok(self, cache_client: Redis):
+        cache = RedisCache(BackgroundTasks(), cache_client)
+        versions = await cache.get_versions(['written'])
+        await cache.set('before_write', b'{}', as_task=False, tags=['written'], versions=versions)
+        assert await cache_client.exists('before_write')
+
+        await cache.invalidate(['written'], as_task=False)
+        await cache.set('stored_after_write', b'{}', as_task=False, tags=['written'], versions=versions)
+
+        assert not await cache_client.exists('stored_after_write')
+        assert await cache.get('stored_after_write') is None
+
+    async def test_value_stored_after_other_writes_ok(self, cache_client: Redis):
+        cache = RedisCache(BackgroundTasks(), cache_client)
+        versions = await cache.get_versions(['read'])
+
+        write_versions = await cache.begin_write(['other'])
+        await cache.invalidate(['other'], write_versions=write_versions, as_task=False)
+        await cache.set('stored_after_write', b'{}', as_task=False, tags=['read'], versions=versions)
+
+        assert await cache_client.exists('stored_after_write')
+
+    async def test_replica_value_not_stored_after_write_ok(self, cache_client: Redis):
+        cache = RedisCache(BackgroundTasks(), cache_client)
+        await cache.invalidate(['written'], as_task=False)
+
+        await cache.set('from_replica', b'{}', as_task=False, tags=['written'], replica=True)
+        await cache.set('from_primary', b'{}', as_task=False, tags=['written'])
+        await cache.set('not_written', b'{}', as_task=False, tags=['read'], replica=True)
+
+        assert not await cache_client.exists('from_replica')
+        assert await cache_client.exists('from_primary')
+        assert await cache_client.exists('not_written')
+
+    async def test_filtered_list_not_cached_ok(self, client: AsyncClient, cache_client: Redis):
+        response = await client.get('/api/v1/menus/', params={'title': 'one-off filter'})
+
+        assert response.status_code == 200
+        assert 'etag' not in response.headers
+        assert await cache_client.keys(make_key('menus?*', {})) == []
+
+    async def test_search_cached_when_popular_ok(self, client: AsyncClient, cache_client: Redis):
+        searched = [await client.get('/api/v1/dishes/search', params={'q': 'popular'})
+                    for _ in range(CACHE_SEARCH_MIN_HITS)]
+
+        assert [response.status_code for response in searched] == [200] * CACHE_SEARCH_MIN_HITS
+        assert all('etag' not in response.headers for response in searched[:-1])
+        assert 'etag' in searched[-1].headers
+        await client.get('/api/v1/dishes/search', params={'q': 'one-off'})
+        assert len(await cache_client.keys(make_key('dishes:search?*', {}))) == 1
+
+    async def test_add_keeps_first_value_ok(self, cache_client: Redis):
+        cache = RedisCache(BackgroundTasks(), cache_client)
+
+        assert await cache.add('added', 'first', ex=10) == 'first'
+        assert await cache.add('added', 'second', ex=10) == 'first'
+
+    async def test_tree_invalidated_ok(self, client: AsyncClient):
+        menu = (await client.post('/api/v1/menus/', json={'title': 'tree_menu', 'description': 'desc'})).json()
+        menu_url = f'/api/v1/menus/{menu["id"]}'
+        assert (await client.get(f'{menu_url}/tree')).json()['submenus'] == []
+
+        submenu = (await client.post(f'{menu_url}/submenus/', json={'title': 'tree_submenu', 'description': 'desc'})).json()
+        submenu_url = f'{menu_url}/submenus/{submenu["id"]}'
+        dish = (await client.post(
+            f'{submenu_url}/dishes/', json={'title': 'tree_dish', 'description': 'desc', 'price': '1.50'})).json()
+        tree = (await client.get(f'{menu_url}/tree')).json()
+        assert (tree['submenus_count'], tree['dishes_count']) == (1, 1)
+        assert tree['submenus'][0]['dishes'] == [dish]
+        catalog = (await client.get('/api/v1/menus/menus/tree')).json()
+        assert [item for item in catalog if item['id'] == menu['id']] == [tree]
+
+        await client.patch(
+            f'{submenu_url}/dishes/{dish["id"]}', json={'title': 'updated_dish', 'description': 'desc', 'price': '2.00'})
+        tree = (await client.get(f'{menu_url}/tree')).json()
+        assert tree['submenus'][0]['dishes'][0]['price'] == '2.00'
+        catalog = (await client.get('/api/v1/menus/menus/tree')).json()
+        assert [item for item in catalog if item['id'] == menu['id']] == [tree]
+
+        await client.delete(menu_url)
+        assert (await client.get(f'{menu_url}/tree')).status_code == 404
+        assert menu['id'] not in [item['id'] for item in (await client.get('/api/v1/menus/menus/tree')).json()]
+
+    async def test_hit_returns_stored_body_ok(self, client: AsyncClient, cache_client: Redis):
+        menu = (await client.post('/api/v1/menus/', json={'title': 'raw_menu', 'description': 'desc'})).json()
+        submenu_url = f'/api/v1/menus/{menu["id"]}/submenus/'
+        submenu = (await client.post(submenu_url, json={'title': 'raw_submenu', 'description': 'desc'})).json()
+        dishes_url = f'{submenu_url}{submenu["id"]}/dishes/'
+        await client.post(dishes_url, json={'title': 'raw_dish', 'description': 'desc', 'price': '1.50'})
+        key = make_key(rules.DISH_LIST_KEY, {
+            'menu_id': menu['id'], 'submenu_id': submenu['id'], 'page': Page(None, None),
+        })
+
+        missed = await client.get(dishes_url)
+        hit = await client.get(dishes_url)
+
+        assert hit.content == missed.content == await cache_client.hget(key, 'value')
+        assert hit.headers['content-type'] == 'application/json'
+        assert hit.json()[0]['price'] == '1.50'
+        await client.delete(f'/api/v1/menus/{menu["id"]}')
+
+    async def test_conditional_get_ok(self, client: AsyncClient, cache_client: Redis):
+        menu = (await client.post('/api/v1/menus/', json={'title': 'etag_menu', 'description': 'desc'})).json()
+        menu_url = f'/api/v1/menus/{menu["id"]}'
+
+        response = await client.get(menu_url)
+        etag = response.headers['etag']
+        not_modified = await client.get(menu_url, headers={'If-None-Match': etag})
+
+        assert not_modified.status_code == 304
+        assert not_modified.content == b''
+        assert not_modified.headers['etag'] == etag
+        assert 'cache-control' in not_modified.headers
+
+        # the counter is changed in place, the script computes the same ETag Python would
+        await client.post(f'{menu_url}/submenus/', json={'title': 'etag_submenu', 'description': 'desc'})
+        modified = await client.get(menu_url, headers={'If-None-Match': etag})
+        assert modified.status_code == 200
+        assert modified.json()['submenus_count'] == 1
+        assert modified.headers['etag'] == make_etag(modified.content) != etag
+        await client.delete(menu_url)
+
+    async def test_batch_changes_counts_once_ok(self, client: AsyncClient):
+        menu = (await client.post('/api/v1/menus/', json={'title': 'batch_menu', 'description': 'desc'})).json()
+        menu_url = f'/api/v1/menus/{menu["id"]}'
+        submenu = (await client.post(f'{menu_url}/submenus/', json={'title': 'old', 'description': 'desc'})).json()
+        await client.post(
+            f'{menu_url}/submenus/{submenu["id"]}/dishes/', json={'title': 'dish', 'description': 'desc', 'price': '1'})
+        await client.get(menu_url)
+        await client.get(f'{menu_url}/submenus/{submenu["id"]}')
+
+        await client.post(f'{menu_url}/submenus/batch', json={
+            'create': [{'title': 'new_1', 'description': 'desc'}, {'title': 'new_2', 'description': 'desc'}],
+            'delete': [submenu['id']],
+        })
+
+        cached_menu = (await client.get(menu_url)).json()
+        assert (cached_menu['submenus_count'], cached_menu['dishes_count']) == (2, 0)
+        assert (await client.get(f'{menu_url}/submenus/{submenu["id"]}')).status_code == 404
+        await client.delete(menu_url)
@@ -0,0 +1,100 @@
+import asyncio
+
+import asyncpg
+import pytest
+import pytest_asyncio
+from asyncpg import DuplicateDatabaseError
+from httpx import AsyncClient
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+from starlette.requests import Request
+
+from core.database import STICKY_COOKIE, SessionRouter, create_engine
+from core.settings import DATABASE_PASSWORD, DATABASE_USER, TEST_DB_NAME
+from tests.conftest import test_db_url
+
+# the replica is another database of the local server, as the tests have a single Postgres instance
+REPLICA_DB_NAME = f'{TEST_DB_NAME}_replica'
+
+
+def make_request(method: str = 'GET', cookies: str = '') -> Request:
+    return Request({'type': 'http', 'method': method, 'headers': [(b'cookie', cookies.encode())]})
+
+
+async def execute_on_server(statement: str) -> None:
+    sys_conn = await asyncpg.connect(database='postgres', user=DATABASE_USER, password=DATABASE_PASSWORD)
+    try:
+        await sys_conn.execute(statement)
+    finally:
+        await sys_conn.close()
+
+
+@pytest_asyncio.fixture
+async def router():
+    try:
+        await execute_on_server(f'CREATE DATABASE "{REPLICA_DB_NAME}" OWNER "{DATABASE_USER}"')
+    except DuplicateDatabaseError:
+        # left by an interrupted run
+        pass
+    primary = create_engine(test_db_url)
+    replica = create_engine(test_db_url.replace(TEST_DB_NAME, REPLICA_DB_NAME))
+    yield SessionRouter(
+        sessionmaker(primary, class_=AsyncSession),
+        [sessionmaker(replica, class_=AsyncSession)],
+    )
+    await primary.dispose()
+    await replica.dispose()
+    await execute_on_server(f'DROP DATABASE "{REPLICA_DB_NAME}"')
+
+
+async def database_of(session_factory: sessionmaker) -> str:
+    async with session_factory() as session:
+        return await session.scalar(text('SELECT current_database()'))
+
+
+@pytest.mark.asyncio
+class TestSessionRouter:
+
+    async def test_reads_go_to_replica_ok(self, router: SessionRouter):
+        assert await database_of(router.for_request(make_request('GET'))) == REPLICA_DB_NAME
+        assert await database_of(router.for_request(make_request('POST'))) == TEST_DB_NAME
+
+    async def test_reads_after_write_go_to_primary_ok(self, router: SessionRouter):
+        assert await database_of(router.for_request(make_request('GET', f'{STICKY_COOKIE}=1'))) == TEST_DB_NAME
+        # reads of other clients stay on the replica
+        assert await database_of(router.for_request(make_request('GET'))) == REPLICA_DB_NAME
+
+    async def test_without_replicas_primary_ok(self, router: SessionRouter):
+        router.replicas = []
+        assert await database_of(router.for_request(make_request('GET'))) == TEST_DB_NAME
+
+
+@pytest.mark.asyncio
+class TestDatabasePool:
+
+    async def test_waiters_counted_ok(self):
+        engine = create_engine(test_db_url, pool_size=1, max_overflow=0)
+        pool = engine.sync_engine.pool
+
+        async with engine.connect() as connection:
+            await connection.execute(text('SELECT 1'))
+            waiting = asyncio.create_task(engine.connect().start())
+            await asyncio.sleep(0.1)
+            assert pool.metrics()['checked_out'] == 1
+            assert pool.metrics()['waiters'] == 1
+        await (await waiting).close()
+
+        metrics = pool.metrics()
+        assert metrics['waiters'] == 0
+        assert metrics['acquisitions'] == 2
+        assert metrics['max_wait_time'] >= 0.1
+        await engine.dispose()
+
+    async def test_get_database_metrics_ok(self, client: AsyncClient):
+        response = await client.get('/api/v1/metrics/database')
+
+        assert response.status_code == 200
+        assert set(response.json()) == {'primary', 'replicas'}
+        assert response.json()['primary']['database'] == 'primary'
+        assert response.json()['primary']['size'] > 0
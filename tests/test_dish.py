@@ -99,6 +99,69 @@ class TestDish:
         assert response.status_code == 200
         assert response.json() == dishes_from_db
 
+    async def test_get_dishes_page_ok(self, client: AsyncClient):
+        url = f'/api/v1/menus/{self.menu1.id}/submenus/{self.submenu1.id}/dishes/'
+        for price in ('1.00', '2.00', '3.00'):
+            await client.post(url, json={'title': f'page_dish_{price}', 'description': 'desc', 'price': price})
+
+        pages = [(await client.get(url, params={'limit': 2})).json()]
+        while len(pages[-1]) == 2:
+            pages.append((await client.get(url, params={'limit': 2, 'after': pages[-1][-1]['id']})).json())
+        dishes = [dish for page in pages for dish in page]
+        filtered = (await client.get(url, params={'title': 'PAGE_DISH', 'min_price': 1.5, 'max_price': 3})).json()
+
+        assert len(dishes) == self.dishes_count + 3
+        assert [dish['id'] for dish in dishes] == sorted(dish['id'] for dish in dishes)
+        # without limit the list is not cut
+        assert (await client.get(url)).json() == dishes
+        assert sorted(dish['price'] for dish in filtered) == ['2.00', '3.00']
+        assert (await client.get(url, params={'limit': 0})).status_code == 422
+
+    async def test_search_dishes_ok(self, client: AsyncClient):
+        url = f'/api/v1/menus/{self.menu1.id}/submenus/{self.submenu1.id}/dishes/'
+        in_description = (await client.post(
+            url, json={'title': 'Суп', 'description': 'Наваристый борщ со сметаной', 'price': '3.00'})).json()
+        in_title = (await client.post(
+            url, json={'title': 'Борщ украинский', 'description': 'Со сметаной', 'price': '4.00'})).json()
+
+        found = (await client.get('/api/v1/dishes/search', params={'q': 'борщ СМЕТ'})).json()
+        next_page = (await client.get(
+            '/api/v1/dishes/search', params={'q': 'борщ смет', 'limit': 1, 'after': in_title['id']})).json()
+
+        assert [dish['id'] for dish in found] == [in_title['id'], in_description['id']]
+        assert found[0]['menu_id'] == str(self.menu1.id)
+        assert found[0]['submenu_id'] == str(self.submenu1.id)
+        assert [dish['id'] for dish in next_page] == [in_description['id']]
+        assert (await client.get('/api/v1/dishes/search', params={'q': '!!'})).json() == []
+        await client.delete(f'{url}{in_title["id"]}')
+        await client.delete(f'{url}{in_description["id"]}')
+
+    async def test_batch_dishes_ok(self, client: AsyncClient, dish: DishCRUD):
+        url = f'/api/v1/menus/{self.menu1.id}/submenus/{self.submenu1.id}/dishes/'
+        created = (await client.post(f'{url}batch', json={'create': [
+            {'title': 'batch_dish_1', 'description': 'desc', 'price': '1.00'},
+            {'title': 'batch_dish_2', 'description': 'desc', 'price': '2.00'},
+        ]})).json()['created']
+
+        response = await client.post(f'{url}batch', json={
+            'update': [{**created[0], 'price': '1.50'}],
+            'delete': [created[1]['id']],
+        })
+        missing = await client.post(f'{url}batch', json={
+            'update': [{**created[0], 'price': '9.99'}],
+            'delete': [created[1]['id']],
+        })
+
+        assert response.status_code == 200
+        assert response.json()['updated'] == [{**created[0], 'price': '1.50'}]
+        assert response.json()['deleted'] == [created[1]['id']]
+        assert missing.status_code == 404
+        # the failed batch is rolled back as a whole
+        assert (await client.get(f'{url}{created[0]["id"]}')).json()['price'] == '1.50'
+        assert len(await dish.get_all(submenu_id=self.submenu1.id)) == self.dishes_count + 1
+        submenu = (await client.get(f'/api/v1/menus/{self.menu1.id}/submenus/{self.submenu1.id}')).json()
+        assert submenu['dishes_count'] == self.dishes_count + 1
+
     async def test_get_dish_ok(self, client: AsyncClient, dish: DishCRUD):
         response = await client.get(f'/api/v1/menus/{self.menu1.id}/submenus/{self.submenu1.id}/dishes/{self.dish1.id}')
         dish_from_db = DishSchema.from_orm(await dish.get_by_id(dish_id=self.dish1.id, submenu_id=self.submenu1.id))
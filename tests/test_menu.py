@@ -1,15 +1,28 @@
-from uuid import UUID
+import csv
+import io
+import json
+import os
+from uuid import UUID, uuid4
 
 import pytest
 import pytest_asyncio
+from celery import states
 from fastapi import HTTPException
 from httpx import AsyncClient
+from openpyxl import load_workbook
+from redis.asyncio.client import Redis  # type: ignore
 from sqlalchemy import func, insert, select
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from apps.menu.cache import EXPORT_JOB_KEY
 from apps.menu.crud import DishCRUD, MenuCRUD, SubmenuCRUD
+from apps.menu.exporters import EXPORTERS
 from apps.menu.models import Menu
-from apps.menu.schemas import BaseSchema, MenuSchema
+from apps.menu.schemas import BaseSchema, DishBaseSchema, ExportFormat, MenuSchema
+from apps.menu.tasks import PROGRESS, gen_export_task, write_export
+from core.cache.cache import make_key
+from core.settings import GENERATED_FILES_DIRNAME
+from tests.conftest import test_db_url
 
 
 @pytest.mark.asyncio
@@ -124,6 +137,145 @@ class TestMenu:
 
         await menu.delete(new_menu.id)
 
+    async def test_counts_after_delete_ok(self, menu: MenuCRUD, submenu: SubmenuCRUD, dish: DishCRUD):
+        new_menu = await menu.create(BaseSchema(title='test_counts_delete', description='test_counts_delete'))
+        submenus = [
+            await submenu.create(
+                BaseSchema(title=f'test_counts_delete{i}',
+                           description='test_counts_delete'),
+                menu_id=new_menu.id,
+            )
+            for i in range(2)
+        ]
+        dishes = [
+            await dish.create(
+                BaseSchema(title=f'test_counts_delete{i}',
+                           description='test_counts_delete'),
+                submenu_id=new_submenu.id,
+            )
+            for i, new_submenu in enumerate(submenus * 2)
+        ]
+        await dish.delete(dishes[0].id, submenus[0].id)
+        await submenu.delete(submenus[1].id, new_menu.id)
+        refreshed_menu = await menu.get_by_id(new_menu.id)
+        refreshed_submenu = await submenu.get_by_id(submenus[0].id, new_menu.id)
+
+        assert refreshed_menu.submenus_count == 1
+        assert refreshed_menu.dishes_count == 1
+        assert refreshed_submenu.dishes_count == 1
+
+        await menu.delete(new_menu.id)
+
+    async def test_create_example_ok(self, menu: MenuCRUD, tmp_path):
+        example = {
+            '1': {
+                'title': 'test_example',
+                'description': 'test_example',
+                'submenus': {
+                    str(i): {
+                        'title': f'test_example{i}',
+                        'description': 'test_example',
+                        'dishes': {
+                            str(j): {'title': f'test_example{j}', 'description': 'test_example', 'price': 10.5}
+                            for j in range(3)
+                        },
+                    }
+                    for i in range(2)
+                },
+            },
+        }
+        file_path = tmp_path / 'example.json'
+        file_path.write_text(json.dumps(example), encoding='utf8')
+
+        response = await menu.create_example(str(file_path))
+        new_menu = await self.session.scalar(select(Menu).filter_by(title='test_example'))
+
+        assert response == {'message': 'database filled'}
+        assert new_menu.submenus_count == 2
+        assert new_menu.dishes_count == 6
+
+        await menu.delete(new_menu.id)
+
+    async def test_write_excel_ok(self, menu: MenuCRUD, submenu: SubmenuCRUD, dish: DishCRUD, tmp_path):
+        new_menu = await menu.create(BaseSchema(title='test_excel', description='test_excel'))
+        new_submenu = await submenu.create(BaseSchema(title='test_excel', description='test_excel'), menu_id=new_menu.id)
+        await dish.create(BaseSchema(title='test_excel', description='test_excel'), submenu_id=new_submenu.id)
+        # progress is reported before the last menu, so there must be more than one
+        other_menu = await menu.create(BaseSchema(title='test_excel_other', description='test_excel_other'))
+        file_path = str(tmp_path / 'menu.xlsx')
+
+        progress: list[int] = []
+        await write_export(EXPORTERS[ExportFormat.xlsx], file_path, test_db_url, on_progress=progress.append)
+        rows = list(load_workbook(file_path, read_only=True).active.iter_rows(values_only=True))
+        menus_count = await self.session.scalar(select(func.count()).select_from(Menu))
+
+        assert len([row for row in rows if row[0]]) == menus_count
+        assert ('test_excel', 'test_excel') in [row[1:3] for row in rows]
+        assert (None, 1, 'test_excel', 'test_excel') in rows
+        assert (None, None, 1, 'test_excel', 'test_excel') in rows
+        assert progress, 'no progress reported'
+        assert progress == sorted(set(progress)) and 0 < progress[-1] < 100
+
+        await menu.delete(new_menu.id)
+        await menu.delete(other_menu.id)
+
+    @pytest.mark.parametrize('export_format', ['csv', 'ndjson'])
+    async def test_export_streamed_ok(self, client: AsyncClient, menu: MenuCRUD, submenu: SubmenuCRUD, dish: DishCRUD,
+                                      export_format: str):
+        new_menu = await menu.create(BaseSchema(title='test_export', description='test_export'))
+        new_submenu = await submenu.create(BaseSchema(title='test_export', description='test_export'), menu_id=new_menu.id)
+        new_dish = await dish.create(
+            DishBaseSchema(title='test_export', description='test_export', price='1.50'), submenu_id=new_submenu.id)
+
+        response = await client.get(f'/api/v1/menus/menus/export?export_format={export_format}')
+        if export_format == 'csv':
+            rows = list(csv.DictReader(io.StringIO(response.text)))
+        else:
+            rows = [json.loads(line) for line in response.text.splitlines()]
+
+        assert response.status_code == 200
+        assert response.headers['content-type'].startswith(EXPORTERS[ExportFormat(export_format)].media_type)
+        assert {
+            'menu_id': str(new_menu.id),
+            'menu_title': 'test_export',
+            'menu_description': 'test_export',
+            'submenu_id': str(new_submenu.id),
+            'submenu_title': 'test_export',
+            'submenu_description': 'test_export',
+            'dish_id': str(new_dish.id),
+            'dish_title': 'test_export',
+            'dish_description': 'test_export',
+            'dish_price': '1.50',
+        } in rows
+
+        await menu.delete(new_menu.id)
+
+    async def test_get_export_status_ok(self, client: AsyncClient, cache_client: Redis):
+        file_id = str(uuid4())
+        url = f'/api/v1/menus/menus/export_status?file_id={file_id}'
+        response = await client.get(url)
+        assert response.status_code == 404
+        assert response.json() == {'detail': 'file not found'}
+
+        # as recorded by generate_export before the task starts
+        await cache_client.set(make_key(EXPORT_JOB_KEY, {'file_id': file_id}), file_id)
+        assert (await client.get(url)).json() == {'file_id': file_id, 'status': 'pending', 'progress': 0}
+
+        gen_export_task.backend.store_result(file_id, {'progress': 40}, PROGRESS)
+        assert (await client.get(url)).json() == {'file_id': file_id, 'status': 'running', 'progress': 40}
+
+        gen_export_task.backend.store_result(file_id, ValueError(), states.FAILURE)
+        assert (await client.get(url)).json()['status'] == 'failed'
+
+        os.makedirs(GENERATED_FILES_DIRNAME, exist_ok=True)
+        file_path = os.path.join(GENERATED_FILES_DIRNAME, f'{file_id}.xlsx')
+        open(file_path, 'wb').close()
+        try:
+            assert (await client.get(url)).json() == {'file_id': file_id, 'status': 'done', 'progress': 100}
+        finally:
+            os.remove(file_path)
+            gen_export_task.backend.forget(file_id)
+
     async def test_cascade_delete_ok(self, menu: MenuCRUD, submenu: SubmenuCRUD, dish: DishCRUD):
         new_menu = await menu.create(BaseSchema(title='test_cascade_delete', description='test_cascade_delete'))
         new_submenu = await submenu.create(